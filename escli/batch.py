@@ -0,0 +1,143 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import click
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch.exceptions import TransportError
+
+from .esconnection import READ_ONLY_REGEX
+from .profiler import QueryProfile
+from .utils import split_statements
+
+
+def read_statements(batch_file):
+    """Read SQL statements separated by semicolon from a file, see split_statements."""
+    with open(batch_file) as f:
+        return split_statements(f.read())
+
+
+def is_barrier(query, explain=False):
+    """Does query change data, so it can't run at the same time as statements before or after it?"""
+    return not explain and not READ_ONLY_REGEX.match(query)
+
+
+def run_batch(es_executor, queries, concurrency=4, output_format="jdbc", explain=False, use_cache=True):
+    """Run queries concurrently with a bounded thread pool.
+
+    All workers share the client of es_executor, so they send requests over its connection pool instead of
+    connecting to Elasticsearch once per query. Statements which change data run alone, after the ones before them
+    are done, and before the ones after them are sent.
+
+    :param es_executor: a connected ESConnection
+    :param queries: list of SQL queries
+    :param concurrency: max number of queries in flight
+    :param output_format: jdbc/csv
+    :param explain: if True, use _explain API.
+    :param use_cache: if False, send every query to the cluster even if result cache has its result
+    :return: generator of (query, raw http response, seconds taken, QueryProfile) in the same order as queries. Response
+        of a failed query is None
+    """
+
+    def run(query):
+        profile = QueryProfile(query)
+        start = time.time()
+        try:
+            output = es_executor.execute_query(
+                query,
+                output_format=output_format,
+                explain=explain,
+                use_console=False,
+                use_cache=use_cache,
+                profile=profile,
+            )
+        except TransportError as error:
+            # errors execute_query doesn't print, such as missing index, fail this statement only
+            click.secho(message=str(error), fg="red", err=True)
+            output = None
+        return query, output, time.time() - start, profile
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        try:
+            for query in queries:
+                if is_barrier(query, explain):
+                    while pending:
+                        yield pending.popleft().result()
+                    yield pool.submit(run, query).result()
+                else:
+                    pending.append(pool.submit(run, query))
+            while pending:
+                yield pending.popleft().result()
+        except KeyboardInterrupt:
+            # pool waits for the queries in flight on exit
+            es_executor.cancel_query()
+            raise
+        finally:
+            # caller stopped early
+            for future in pending:
+                future.cancel()
+
+
+def run_batch_async(es_executor, queries, loop, concurrency=4, output_format="jdbc", explain=False, use_cache=True):
+    """Run queries concurrently on an AsyncESConnection, whose event loop runs in another thread, so responses keep
+    arriving while the caller formats the previous ones. Statements which change data run alone, as in run_batch.
+
+    :param es_executor: an AsyncESConnection connected in loop
+    :param loop: event loop running in another thread, see start_event_loop
+    :return: generator of (query, raw http response, seconds taken, QueryProfile) in the same order as queries
+    """
+
+    async def get_semaphore():
+        return asyncio.Semaphore(concurrency)
+
+    semaphore = asyncio.run_coroutine_threadsafe(get_semaphore(), loop).result()
+
+    async def run(query):
+        async with semaphore:
+            profile = QueryProfile(query)
+            start = time.time()
+            try:
+                output = await es_executor.execute_query(
+                    query,
+                    output_format=output_format,
+                    explain=explain,
+                    use_console=False,
+                    use_cache=use_cache,
+                    profile=profile,
+                )
+            except TransportError as error:
+                # as in run_batch
+                click.secho(message=str(error), fg="red", err=True)
+                output = None
+            return query, output, time.time() - start, profile
+
+    pending = deque()
+    try:
+        for query in queries:
+            if is_barrier(query, explain):
+                while pending:
+                    yield pending.popleft().result()
+                yield asyncio.run_coroutine_threadsafe(run(query), loop).result()
+            else:
+                pending.append(asyncio.run_coroutine_threadsafe(run(query), loop))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # caller stopped early
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,256 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+from .config import config_location, ensure_dir_exists
+
+# quoted string literals, which keep their whitespace, or runs of whitespace outside of them
+QUERY_WHITESPACE_REGEX = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+
+class MetadataCache:
+    """MetadataCache instances keep cluster metadata on disk, one file per endpoint, so the CLI can skip the round
+    trips of checking plugins, version and indices when it starts.
+    """
+
+    def __init__(self, ttl=3600, cache_dir=None):
+        """Initialize a MetadataCache instance.
+
+        :param ttl: seconds before cached metadata expires, 0 disables the cache
+        :param cache_dir: directory of cache files, by default it's "cache" under config location
+        """
+        self.ttl = ttl
+        self.cache_dir = cache_dir or os.path.join(config_location(), "cache")
+
+    def _path(self, endpoint):
+        key = hashlib.sha1(str(endpoint).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "metadata-%s.json" % key)
+
+    def get(self, endpoint):
+        """Return metadata cached for endpoint, or None if there is no fresh entry."""
+        if not self.ttl:
+            return None
+
+        try:
+            with open(self._path(endpoint)) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if metadata.get("endpoint") != endpoint or time.time() - metadata.get("timestamp", 0) > self.ttl:
+            return None
+
+        return metadata
+
+    def set(self, endpoint, plugins, es_version, indices):
+        """Save metadata of endpoint. The file is replaced atomically, so readers never see a partial write."""
+        if not self.ttl:
+            return
+
+        path = self._path(endpoint)
+        metadata = {
+            "endpoint": endpoint,
+            "timestamp": time.time(),
+            "plugins": plugins,
+            "es_version": es_version,
+            "indices": indices,
+        }
+
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            ensure_dir_exists(path)
+            with open(temp_path, "w") as f:
+                json.dump(metadata, f)
+            os.replace(temp_path, path)
+        except OSError:
+            # cache is only an optimization, go on without it
+            pass
+
+    def invalidate(self, endpoint=None):
+        """Remove metadata cached for endpoint, or for all endpoints if endpoint is None."""
+        paths = [self._path(endpoint)] if endpoint else glob.glob(os.path.join(self.cache_dir, "metadata-*.json"))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class LRUCache:
+    """In-memory cache which evicts the least recently used entries, once the total size of entries exceeds max_size.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        """Initialize a LRUCache instance.
+
+        :param max_size: max total size of entries
+        :param sizeof: function returning size of an entry value, in the same unit as max_size
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            # the newest entry is kept even if it's larger than max_size alone
+            while self.size > self.max_size and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def get_result_cache(config):
+    """Get result cache configured in esclirc [main] section, or None if it's off."""
+    backend = config["main"].get("result_cache", "off")
+    ttl = config["main"].as_int("result_cache_ttl")
+    max_size = config["main"].as_int("result_cache_size") * 1024 * 1024
+
+    if backend == "memory":
+        return MemoryResultCache(ttl, max_size)
+    if backend == "disk":
+        return DiskResultCache(ttl, max_size)
+    return None
+
+
+class ResultCache:
+    """Base class of caches of query results, keyed by normalized query text, output format and endpoint."""
+
+    def __init__(self, ttl, max_size):
+        """Initialize a ResultCache instance.
+
+        :param ttl: seconds before a cached result expires
+        :param max_size: max total size of cached results, in bytes
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+
+    @staticmethod
+    def key(endpoint, query, output_format, explain=False, username=None):
+        """Get cache key of a query. Queries only different in whitespace outside of string literals, or in trailing
+        semicolon, share the same key. Users of the same endpoint don't, they may be allowed to read different data.
+        """
+        query = QUERY_WHITESPACE_REGEX.sub(lambda match: match.group(1) or " ", query.strip().strip(";").strip())
+        text = "\n".join([str(endpoint), str(username or ""), output_format, "explain" if explain else "query", query])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return cached result, or None if there is no fresh one."""
+        raise NotImplementedError()
+
+    def set(self, key, data):
+        raise NotImplementedError()
+
+
+class MemoryResultCache(ResultCache):
+    """Results kept in memory of this process, evicted by TTL, and least recently used first once they take more than
+    max_size.
+    """
+
+    def __init__(self, ttl, max_size):
+        super(MemoryResultCache, self).__init__(ttl, max_size)
+        self.entries = LRUCache(max_size, sizeof=lambda entry: entry[1])
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+
+        return entry[2]
+
+    def set(self, key, data):
+        size = len(data) if isinstance(data, str) else len(json.dumps(data))
+        self.entries.set(key, (time.time(), size, data))
+
+
+class DiskResultCache(ResultCache):
+    """Results kept as json files under config location, shared by all escli processes. They are evicted by TTL, and
+    oldest first once they take more than max_size.
+    """
+
+    def __init__(self, ttl, max_size, cache_dir=None):
+        super(DiskResultCache, self).__init__(ttl, max_size)
+        self.cache_dir = cache_dir or os.path.join(config_location(), "cache", "results")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "%s.json" % key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, data):
+        path = self._path(key)
+        temp_path = "%s.%d.tmp" % (path, threading.get_ident())
+
+        try:
+            ensure_dir_exists(path)
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+            self.evict()
+        except OSError:
+            # cache is only an optimization, go on without it
+            pass
+
+    def evict(self):
+        files = [(os.path.getmtime(path), os.path.getsize(path), path) for path in glob.glob(self._path("*"))]
+        total_size = sum(size for _, size, _ in files)
+
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            os.remove(path)
+            total_size -= size
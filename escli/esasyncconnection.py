@@ -0,0 +1,297 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import base64
+import click
+import itertools
+import json
+import random
+import threading
+import time
+
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, ConnectionError, RequestError, TransportError
+from elasticsearch.serializer import JSONSerializer
+
+from .esconnection import READ_ONLY_REGEX, RetryPolicy
+
+
+def start_event_loop():
+    """Run a new event loop in a daemon thread, for synchronous code to submit coroutines to with
+    asyncio.run_coroutine_threadsafe.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+class AsyncESConnection:
+    """AsyncESConnection instances are the asyncio counterpart of ESConnection, with the same API on aiohttp. Requests
+    of set_connection are sent concurrently, and queries are awaited, so that callers can overlap them with other work.
+
+    Supports basic auth, AWS endpoints signed with AWS4Auth, and plain Elasticsearch. Requires aiohttp.
+    """
+
+    def __init__(
+        self,
+        endpoint=None,
+        http_auth=None,
+        metadata_cache=None,
+        result_cache=None,
+        transport_settings=None,
+        retry_policy=None,
+    ):
+        """Initialize an AsyncESConnection instance. Session is opened by set_connection.
+
+        :param endpoint: an url in the format of "http:localhost:9200", or urls of several nodes separated by comma
+        :param http_auth: a tuple in the format of (username, password)
+        :param metadata_cache: a MetadataCache to load plugins, version and indices from, instead of the cluster
+        :param result_cache: a ResultCache to answer repeated queries from, instead of the cluster
+        :param transport_settings: http settings, see get_transport_settings. timeout, maxsize and http_compress apply
+        :param retry_policy: RetryPolicy of read only queries lost on connection errors
+        """
+        self.session = None
+        self.es_version = None
+        self.plugins = None
+        self.aws_auth = None
+        self.indices_list = []
+        self.endpoint = endpoint
+        self.hosts = [host.strip().rstrip("/") for host in (endpoint or "http://localhost:9200").split(",")]
+        self.http_auth = http_auth
+        self.metadata_cache = metadata_cache
+        self.result_cache = result_cache
+        self.transport_settings = dict(transport_settings or {})
+        self.serializer = self.transport_settings.get("serializers", {}).get("application/json") or JSONSerializer()
+        self.is_metadata_cached = False
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.request_count = itertools.count()
+
+    def is_aws(self):
+        return self.hosts[0].endswith("es.amazonaws.com")
+
+    async def open_session(self):
+        # optional dependency, only needed by this connection
+        import aiohttp
+
+        settings = self.transport_settings
+        timeout = aiohttp.ClientTimeout(total=settings["timeout"]) if settings.get("timeout") else None
+        # same as Open Distro client of ESConnection, certificates of clusters with authentication are not verified
+        connector = aiohttp.TCPConnector(
+            limit_per_host=settings.get("maxsize") or 10, ssl=False if self.http_auth else None
+        )
+        headers = {"Content-Type": "application/json"}
+        if settings.get("http_compress"):
+            headers["Accept-Encoding"] = "gzip,deflate"
+        if self.http_auth:
+            credentials = "%s:%s" % self.http_auth
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+        if self.is_aws():
+            # only needed by AWS endpoints, and slow to import
+            import boto3
+            from requests_aws4auth import AWS4Auth
+
+            session = boto3.Session()
+            credentials = session.get_credentials()
+            self.aws_auth = AWS4Auth(credentials.access_key, credentials.secret_key, session.region_name, "es")
+
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers=headers,
+        )
+
+    def sign(self, method, url, params, data):
+        """Get headers signed by AWS4Auth, which signs requests of the requests library."""
+        import requests
+
+        request = requests.Request(method, url, params=params, data=data, headers={"Content-Type": "application/json"})
+        return dict(self.aws_auth(request.prepare()).headers)
+
+    async def perform_request(self, method, url, params=None, body=None):
+        """Send a request to the next node, or the one after it on connection errors, and decode its response.
+
+        :return: decoded json, or text of other content types
+        :raises TransportError: of the same type Elasticsearch client raises for the status code
+        :raises ConnectionError: if no node can be reached
+        """
+        import aiohttp
+
+        data = json.dumps(body) if body is not None else None
+        # round robin, each request tries the other nodes after its own
+        start = next(self.request_count) % len(self.hosts)
+        error = None
+        for host in self.hosts[start:] + self.hosts[:start]:
+            full_url = host + url
+            headers = self.sign(method, full_url, params, data) if self.aws_auth else None
+            try:
+                async with self.session.request(
+                    method, full_url, params=params, data=data, headers=headers
+                ) as response:
+                    raw_data = await response.text()
+                    status, content_type = response.status, response.content_type
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = ConnectionError("N/A", str(e), e)
+        else:
+            raise error
+
+        if status >= 400:
+            try:
+                info = json.loads(raw_data)
+                message = info.get("error", raw_data)
+            except ValueError:
+                info, message = None, raw_data
+            raise HTTP_EXCEPTIONS.get(status, TransportError)(status, message, info)
+
+        return self.serializer.loads(raw_data) if content_type == "application/json" else raw_data
+
+    async def send_with_retry(self, send, is_retryable=True):
+        """Await send(), and await it again with jittered exponential backoff of retry_policy, if it raises
+        ConnectionError, as ESConnection.send_with_retry does. A session needs no reconnecting.
+
+        :param send: function returning a coroutine which sends a request
+        :param is_retryable: if False, connection errors are raised right away
+        :return: what the coroutine returns
+        :raises ConnectionError: once retries are used up
+        """
+        policy = self.retry_policy
+        for attempt in itertools.count(1):
+            try:
+                return await send()
+            except ConnectionError:
+                if not is_retryable or attempt > policy.retries:
+                    raise
+
+            delay = random.uniform(0, min(policy.backoff * 2 ** (attempt - 1), policy.max_backoff))
+            click.secho(
+                message="Connection lost, retrying in %.1fs (%d/%d)" % (delay, attempt, policy.retries),
+                fg="yellow",
+                err=True,
+            )
+            await asyncio.sleep(delay)
+
+    async def is_sql_plugin_installed(self):
+        self.plugins = await self.perform_request("GET", "/_cat/plugins", params={"s": "component", "v": "true"})
+        sql_plugin_name_list = ["opendistro-sql", "opendistro_sql"]
+        return any(x in self.plugins for x in sql_plugin_name_list)
+
+    async def get_indices(self):
+        self.indices_list = list((await self.perform_request("GET", "/_alias")).keys())
+
+    async def set_connection(self, is_reconnect=False):
+        """Open session, and fetch plugins, version and indices of the cluster concurrently, unless they are cached.
+
+        Unlike ESConnection, it doesn't exit when the cluster can't be used, since it may run in an event loop of
+        another thread.
+
+        :return: True if connected, False if the cluster is unreachable or has no SQL plugin
+        """
+        if not self.session:
+            await self.open_session()
+
+        metadata = self.metadata_cache.get(self.endpoint) if self.metadata_cache and not is_reconnect else None
+        if metadata:
+            self.plugins = metadata["plugins"]
+            self.es_version = metadata["es_version"]
+            self.indices_list = metadata["indices"]
+            self.is_metadata_cached = True
+            return True
+
+        requests = [
+            asyncio.ensure_future(request)
+            for request in (self.is_sql_plugin_installed(), self.perform_request("GET", "/"), self.get_indices())
+        ]
+        try:
+            is_sql_plugin_installed, info, _ = await asyncio.gather(*requests)
+            if not is_sql_plugin_installed:
+                click.secho(
+                    message="Must have Open Distro SQL plugin installed in your Elasticsearch "
+                    "instance!\nCheck this out: https://github.com/opendistro-for-elasticsearch/sql",
+                    fg="red",
+                )
+                click.echo(self.plugins)
+                return False
+
+            self.es_version = info["version"]["number"]
+            self.is_metadata_cached = False
+            if self.metadata_cache:
+                self.metadata_cache.set(self.endpoint, self.plugins, self.es_version, self.indices_list)
+            return True
+
+        except ConnectionError as error:
+            if is_reconnect:
+                raise error
+            else:
+                click.secho(message="Can not connect to endpoint %s" % self.endpoint, fg="red")
+                click.echo(repr(error))
+                return False
+
+        finally:
+            # the others are still in flight if one failed
+            for request in requests:
+                request.cancel()
+
+    async def execute_query(
+        self, query, output_format="jdbc", explain=False, use_console=True, use_cache=True, profile=None
+    ):
+        """Send SQL query and get response, as ESConnection.execute_query does. Read only queries lost on connection
+        errors are sent again, as retry_policy allows.
+
+        :param profile: a QueryProfile to add network and decoding time, bytes and rows of the query to
+        :return: raw http response, or None if the query fails
+        """
+        final_query = query.strip().strip(";")
+
+        cache_key = None
+        # statements changing data are always sent
+        if self.result_cache and use_cache and (explain or READ_ONLY_REGEX.match(final_query)):
+            username = self.http_auth[0] if self.http_auth else None
+            cache_key = self.result_cache.key(self.endpoint, final_query, output_format, explain, username)
+            data = self.result_cache.get(cache_key)
+            if data is not None:
+                return data
+
+        start = time.perf_counter()
+        data = None
+        try:
+            data = await self.send_with_retry(
+                lambda: self.perform_request(
+                    "POST",
+                    "/_opendistro/_sql/_explain" if explain else "/_opendistro/_sql/",
+                    params=None if explain else {"format": output_format},
+                    body={"query": final_query},
+                ),
+                explain or bool(READ_ONLY_REGEX.match(final_query)),
+            )
+            if cache_key:
+                self.result_cache.set(cache_key, data)
+            return data
+
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
+        except RequestError as error:
+            click.secho(message=str(error.info["error"]), fg="red")
+        finally:
+            if profile:
+                # decoding is not measured apart from network
+                profile.add("network", time.perf_counter() - start)
+                profile.count_rows(data)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
@@ -43,4 +43,5 @@ def _is_complete(sql):
 
 def _multiline_exception(text):
     text = text.strip()
-    return _is_complete(text)
+    # special commands, such as "\refresh", end with the line
+    return text.startswith("\\") or _is_complete(text)
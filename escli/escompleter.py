@@ -0,0 +1,164 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import unicode_literals
+
+import re
+import sys
+
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from prompt_toolkit.completion import Completer, Completion
+
+from .cache import LRUCache
+from .utils import extract_tables
+
+# word being typed, index names may contain "-", "." and "*"
+WORD_REGEX = re.compile(r"[\w\-.*]*$")
+# words and punctuation before the word being typed
+TOKEN_REGEX = re.compile(r"[\w\-.*]+|[^\s\w]")
+
+# max number of completions shown for one word, to keep the menu fast on clusters with many indices
+MAX_COMPLETIONS = 100
+# max bytes of field names kept in memory for completion
+MAPPING_CACHE_SIZE = 32 * 1024 * 1024
+
+
+class PrefixIndex:
+    """Sorted list of words, searched by case insensitive prefix with binary search."""
+
+    def __init__(self, words):
+        entries = sorted((word.lower(), word) for word in set(words))
+        self.keys = [key for key, _ in entries]
+        self.words = [word for _, word in entries]
+
+    def find(self, prefix, limit=MAX_COMPLETIONS):
+        """Return at most limit words starting with prefix, in alphabetical order."""
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        end = start
+
+        while end < len(self.keys) and end - start < limit and self.keys[end].startswith(prefix):
+            end += 1
+
+        return self.words[start:end]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, word):
+        key = word.lower()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.words[i] == word:
+                return True
+            i += 1
+
+        return False
+
+    def sizeof(self):
+        """Approximate memory used by the index, in bytes."""
+        return sum(sys.getsizeof(key) + sys.getsizeof(word) for key, word in zip(self.keys, self.words))
+
+
+class ESCompleter(Completer):
+    """Completer of SQL statements, which suggests index names only where an index is expected, such as after FROM,
+    and fields of the queried indices, keywords and functions everywhere else.
+    """
+
+    def __init__(self, keywords, functions, indices, get_fields=None):
+        """Initialize an ESCompleter instance.
+
+        :param keywords: SQL keywords
+        :param functions: SQL functions
+        :param indices: index names
+        :param get_fields: function returning field names of an index, called in background threads
+        """
+        self.keywords = PrefixIndex(keywords)
+        self.functions = PrefixIndex(functions)
+        self.indices = PrefixIndex(indices)
+        self.get_fields = get_fields
+        self.fields = LRUCache(MAPPING_CACHE_SIZE, sizeof=PrefixIndex.sizeof)
+        self.pending_fields = set()
+        self.fetch_executor = None
+
+    def get_completions(self, document, complete_event):
+        text_before_word = document.text_before_cursor
+        word = WORD_REGEX.search(text_before_word).group()
+        text_before_word = text_before_word[: len(text_before_word) - len(word)]
+        tables = extract_tables(document.text)
+
+        for candidate, meta in self.get_candidates(word, TOKEN_REGEX.findall(text_before_word), tables):
+            yield Completion(candidate, start_position=-len(word), display_meta=meta)
+
+    def get_candidates(self, word, tokens, tables=()):
+        """Get (candidate, type) pairs for word, according to the tokens of statement before it, and the indices
+        the statement queries.
+        """
+        if self.expects_index(tokens):
+            return [(index, "index") for index in self.indices.find(word)]
+
+        fields = []
+        for table in tables:
+            fields.extend(field for field in self.find_fields(table, word) if field not in fields)
+
+        fields = [(field, "field") for field in fields]
+        keywords = [(keyword, "keyword") for keyword in self.keywords.find(word)]
+        functions = [(function, "function") for function in self.functions.find(word)]
+        return fields + keywords + functions
+
+    def find_fields(self, table, prefix):
+        """Find fields of an index by prefix. Mapping of the index is fetched in background on first use, so typing
+        never waits for it, and fields show up once it arrives.
+        """
+        fields = self.fields.get(table)
+        if fields is not None:
+            return fields.find(prefix)
+
+        # skip index names which are still being typed
+        is_index = table in self.indices or "*" in table
+        if self.get_fields and is_index and table not in self.pending_fields:
+            self.pending_fields.add(table)
+            if not self.fetch_executor:
+                self.fetch_executor = ThreadPoolExecutor(max_workers=2)
+            self.fetch_executor.submit(self.fetch_fields, table)
+
+        return []
+
+    def fetch_fields(self, table):
+        try:
+            self.fields.set(table, PrefixIndex(self.get_fields(table)))
+        except Exception:
+            # no such index, or cluster is not reachable. Suggest no fields, and try again next time
+            pass
+        finally:
+            self.pending_fields.discard(table)
+
+    @staticmethod
+    def expects_index(tokens):
+        """Is an index name expected after tokens? e.g. "SELECT * FROM", "... JOIN" or "SHOW TABLES LIKE"."""
+        tokens = [token.lower() for token in tokens]
+        if not tokens:
+            return False
+
+        if tokens[-1] in ("from", "join"):
+            return True
+        if tokens[-2:] == ["tables", "like"]:
+            return True
+
+        # more indices in a comma separated FROM list
+        if tokens[-1] == "," and len(tokens) >= 3:
+            return ESCompleter.expects_index(tokens[:-2])
+
+        return False
@@ -12,17 +12,302 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import boto3
 import click
+import gzip
+import itertools
 import logging
+import queue
+import random
+import re
+import socket
 import ssl
 import sys
+import threading
+import time
 import urllib3
 
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from elasticsearch.exceptions import ConnectionError, RequestError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from elasticsearch import Elasticsearch, RequestsHttpConnection, Urllib3HttpConnection
+from elasticsearch.connection_pool import ConnectionSelector, RandomSelector, RoundRobinSelector
+from elasticsearch.exceptions import ConnectionError, RequestError, TransportError
 from elasticsearch.connection import create_ssl_context
-from requests_aws4auth import AWS4Auth
+
+from .serializer import LazyPage, get_serializer
+from .utils import extract_tables
+
+
+# options in [main] section of esclirc, with the keyword arguments of Elasticsearch client they are passed as
+TRANSPORT_OPTIONS = {
+    "http_compress": "http_compress",
+    "timeout": "timeout",
+    "max_connections": "maxsize",
+    "max_retries": "max_retries",
+    "node_selector": "selector_class",
+}
+
+# statements which only read data, and can be sent again safely if connection is lost before their response arrives
+READ_ONLY_REGEX = re.compile(r"^\s*(select|show|describe|desc|explain|with)\b", re.IGNORECASE)
+
+# Queries lost on connection errors are sent again up to retries times. Before nth retry, it waits a random time
+# between 0 and min(backoff * 2 ** (n - 1), max_backoff) seconds, so that clients don't retry all at once.
+RetryPolicy = namedtuple("RetryPolicy", "retries backoff max_backoff")
+
+RetryPolicy.__new__.__defaults__ = (3, 0.5, 10.0)
+
+# keys of a _search request body, one of which is in DSL explained from a query that can be profiled. Joins are
+# explained as several requests instead.
+SEARCH_BODY_KEYS = {"query", "aggregations", "from", "size", "sort", "_source"}
+
+# queries with LIMIT can't be split into slices, each slice would apply it on its own. The group is the number of
+# rows, of "LIMIT 10" or "LIMIT 20, 10"
+LIMIT_REGEX = re.compile(r"\blimit\s+(?:\d+\s*,\s*)?(\d+)", re.IGNORECASE)
+
+# how long scroll contexts of sliced exports are kept alive between pages
+SCROLL_KEEP_ALIVE = "1m"
+
+# size of chunks the body of a response is written out in by stream_query
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# weight of the latest response time in average latency of a node, and in time and bytes per row of cursor pages
+LATENCY_WEIGHT = 0.3
+
+# cursor pages sized by PageSizer take about this many seconds to fetch, and are no larger than this many bytes
+PAGE_TARGET_LATENCY = 0.5
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+# bounds of fetch_size picked by PageSizer, and fetch_size of indices not measured yet
+MIN_FETCH_SIZE = 50
+MAX_FETCH_SIZE = 10000
+DEFAULT_FETCH_SIZE = 500
+
+
+class LeastLatencySelector(ConnectionSelector):
+    """Select the node with the lowest average response time. Nodes which haven't responded yet are tried first."""
+
+    def select(self, connections):
+        return min(connections, key=lambda connection: getattr(connection, "latency", None) or 0.0)
+
+
+SELECTORS = {"round_robin": RoundRobinSelector, "random": RandomSelector, "least_latency": LeastLatencySelector}
+
+
+def get_transport_settings(config, **overrides):
+    """Get keyword arguments of Elasticsearch clients from [main] section of esclirc, and overrides given in command
+    line. Options which are empty in esclirc, and None in overrides, are left to defaults of the client.
+
+    :param config: parsed esclirc
+    :param overrides: options of TRANSPORT_OPTIONS and "sniff" given in command line
+    :return: dict of keyword arguments, such as {"http_compress": True, "timeout": 30.0}
+    """
+    main = config["main"]
+    converters = {
+        "http_compress": main.as_bool,
+        "timeout": main.as_float,
+        "max_connections": main.as_int,
+        "max_retries": main.as_int,
+        "node_selector": main.get,
+    }
+
+    settings = {}
+    for option, kwarg in TRANSPORT_OPTIONS.items():
+        if overrides.get(option) is not None:
+            settings[kwarg] = overrides[option]
+        elif main.get(option, "") != "":
+            settings[kwarg] = converters[option](option)
+
+    if "selector_class" in settings:
+        settings["selector_class"] = SELECTORS[settings["selector_class"]]
+
+    sniff = overrides.get("sniff")
+    if sniff is None:
+        sniff = main.get("sniff", "") != "" and main.as_bool("sniff")
+    if sniff:
+        # find all nodes of the cluster on start, and again when one fails
+        settings.update(sniff_on_start=True, sniff_on_connection_fail=True)
+
+    json_decoder = main.get("json_decoder", "")
+    if json_decoder:
+        try:
+            serializer = get_serializer(json_decoder)
+        except ImportError:
+            click.secho(
+                message="%s is not installed, decoding json with json module" % json_decoder, fg="yellow", err=True
+            )
+            serializer = get_serializer("json")
+        settings["serializers"] = {serializer.mimetype: serializer}
+
+    return settings
+
+
+def get_retry_policy(config):
+    """Get RetryPolicy of queries from [main] section of esclirc."""
+    main = config["main"]
+    policy = RetryPolicy()
+    return policy._replace(
+        retries=main.as_int("query_retries") if "query_retries" in main else policy.retries,
+        backoff=main.as_float("retry_backoff") if "retry_backoff" in main else policy.backoff,
+    )
+
+
+def get_source_field(source, name):
+    """Get value of field name from _source of a hit, following dots into objects, such as "a.b" of {"a": {"b": 1}}."""
+    if name in source:
+        return source[name]
+
+    value = source
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+
+    return value
+
+
+def count_datarows(page):
+    """Count rows of a jdbc page, or rows decoded so far of a LazyPage."""
+    if isinstance(page, LazyPage):
+        return page.decoded_rows
+    return len(page.get("datarows", []))
+
+
+class RequestStats(threading.local):
+    """Time spent on http requests sent from current thread since last reset, and on decoding their responses.
+
+    While lazy_rows is set, jdbc responses are decoded into LazyPage, with datarows decoded as they are iterated.
+    """
+
+    def __init__(self):
+        self.lazy_rows = False
+        self.reset()
+
+    def reset(self):
+        self.request_time = 0.0
+        self.decode_time = 0.0
+        self.size = 0
+
+
+class PageSizer:
+    """Pick fetch_size of cursors from time and bytes per row measured on pages of earlier queries to the same indices,
+    so that a page takes about target_latency seconds to fetch and holds at most max_page_bytes.
+
+    A cursor keeps the fetch_size it's opened with, so pages of a query size the cursors of the queries after it.
+    """
+
+    def __init__(self, target_latency=PAGE_TARGET_LATENCY, max_page_bytes=MAX_PAGE_BYTES):
+        self.target_latency = target_latency
+        self.max_page_bytes = max_page_bytes
+        # indices -> (seconds per row, bytes per row)
+        self.per_row = {}
+
+    def fetch_size(self, query):
+        estimate = self.per_row.get(self._key(query))
+        if not estimate:
+            return DEFAULT_FETCH_SIZE
+
+        seconds, size = estimate
+        rows = min(
+            self.target_latency / seconds if seconds else MAX_FETCH_SIZE,
+            self.max_page_bytes / size if size else MAX_FETCH_SIZE,
+        )
+        return int(min(max(rows, MIN_FETCH_SIZE), MAX_FETCH_SIZE))
+
+    def record(self, query, seconds, size, rows):
+        """Add time and bytes a page of rows of query took to the averages of its indices."""
+        if not rows:
+            return
+
+        key = self._key(query)
+        measured = (seconds / rows, size / rows)
+        previous = self.per_row.get(key)
+        if previous:
+            measured = tuple(LATENCY_WEIGHT * new + (1 - LATENCY_WEIGHT) * old for new, old in zip(measured, previous))
+        self.per_row[key] = measured
+
+    @staticmethod
+    def _key(query):
+        return tuple(sorted(extract_tables(query)))
+
+
+class ProfilingDeserializer:
+    """Wrap deserializer of a transport, to measure decoding time and size of responses."""
+
+    def __init__(self, deserializer, stats):
+        self.deserializer = deserializer
+        self.stats = stats
+
+    def loads(self, s, mimetype=None):
+        start = time.perf_counter()
+        try:
+            if self.stats.lazy_rows and (mimetype or "application/json").startswith("application/json"):
+                # time spent on decoding rows is not measured, it's spread over formatting them
+                return LazyPage(s)
+            return self.deserializer.loads(s, mimetype)
+        finally:
+            self.stats.decode_time += time.perf_counter() - start
+            self.stats.size += len(s)
+
+
+class QueryCancelled(TransportError):
+    """Raised by a request aborted by ESConnection.cancel_query. It's not retried by the transport."""
+
+
+class QueryFailed(TransportError):
+    """Raised by generators of pages once the error which stopped them is printed, so that callers fail instead of
+    taking the pages so far for the whole result.
+    """
+
+
+class CancellableHttpConnection(Urllib3HttpConnection):
+    """Urllib3HttpConnection which keeps track of the http connections checked out of its pool, so requests in flight
+    can be aborted from another thread by shutting down their sockets.
+    """
+
+    def __init__(self, cancel_event=None, **kwargs):
+        super(CancellableHttpConnection, self).__init__(**kwargs)
+        self.cancel_event = cancel_event or threading.Event()
+        self.in_flight = set()
+        self.latency = None
+
+        get_conn, put_conn = self.pool._get_conn, self.pool._put_conn
+
+        def _get_conn(timeout=None):
+            conn = get_conn(timeout)
+            self.in_flight.add(conn)
+            return conn
+
+        def _put_conn(conn):
+            self.in_flight.discard(conn)
+            put_conn(conn)
+
+        self.pool._get_conn, self.pool._put_conn = _get_conn, _put_conn
+
+    def perform_request(self, *args, **kwargs):
+        if self.cancel_event.is_set():
+            raise QueryCancelled("N/A", "Query cancelled")
+
+        start = time.time()
+        try:
+            response = super(CancellableHttpConnection, self).perform_request(*args, **kwargs)
+        except ConnectionError:
+            if self.cancel_event.is_set():
+                raise QueryCancelled("N/A", "Query cancelled")
+            raise
+
+        elapsed = time.time() - start
+        self.latency = (
+            elapsed if self.latency is None else LATENCY_WEIGHT * elapsed + (1 - LATENCY_WEIGHT) * self.latency
+        )
+        return response
+
+    def abort(self):
+        for conn in list(self.in_flight):
+            if getattr(conn, "sock", None):
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    # already closed
+                    pass
 
 
 class ESConnection:
@@ -30,13 +315,25 @@ class ESConnection:
     as well as send user's SQL query to Elasticsearch.
     """
 
-    def __init__(self, endpoint=None, http_auth=None):
+    def __init__(
+        self,
+        endpoint=None,
+        http_auth=None,
+        metadata_cache=None,
+        result_cache=None,
+        transport_settings=None,
+        retry_policy=None,
+    ):
         """Initialize an ESConnection instance.
 
         Set up client and get indices list.
 
-        :param endpoint: an url in the format of "http:localhost:9200"
+        :param endpoint: an url in the format of "http:localhost:9200", or urls of several nodes separated by comma
         :param http_auth: a tuple in the format of (username, password)
+        :param metadata_cache: a MetadataCache to load plugins, version and indices from, instead of the cluster
+        :param result_cache: a ResultCache to answer repeated queries from, instead of the cluster
+        :param transport_settings: keyword arguments passed to every kind of client, see get_transport_settings
+        :param retry_policy: RetryPolicy of read only queries lost on connection errors
         """
         self.client = None
         self.ssl_context = None
@@ -45,14 +342,50 @@ class ESConnection:
         self.aws_auth = None
         self.indices_list = []
         self.endpoint = endpoint
+        self.hosts = [host.strip() for host in endpoint.split(",") if host.strip()] if endpoint else [endpoint]
         self.http_auth = http_auth
+        self.metadata_cache = metadata_cache
+        self.result_cache = result_cache
+        self.transport_settings = dict(transport_settings or {})
+        if self.transport_settings.get("sniff_on_start") and all(host.startswith("https") for host in self.hosts):
+            # sniffed nodes come without scheme
+            self.transport_settings["scheme"] = "https"
+        self.is_metadata_cached = False
+        self.cancel_event = threading.Event()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.request_stats = RequestStats()
+        self.page_sizer = PageSizer()
 
     def get_indices(self):
         if self.client:
             res = self.client.indices.get_alias().keys()
             self.indices_list = list(res)
 
+    def get_fields(self, index):
+        """Get names of all fields in mappings of index, with sub-fields joined by dot, such as "name.keyword".
+
+        :param index: index name, alias or pattern
+        :return: sorted list of field names
+        """
+        fields = set()
+
+        def add_fields(properties, prefix=""):
+            for name, mapping in properties.items():
+                fields.add(prefix + name)
+                add_fields(mapping.get("properties", {}), prefix + name + ".")
+                # multi-fields, such as "keyword" of text fields
+                add_fields(mapping.get("fields", {}), prefix + name + ".")
+
+        for index_mapping in self.client.indices.get_mapping(index=index).values():
+            add_fields(index_mapping.get("mappings", {}).get("properties", {}))
+
+        return sorted(fields)
+
     def get_aes_client(self):
+        # only needed by AWS endpoints, and slow to import
+        import boto3
+        from requests_aws4auth import AWS4Auth
+
         service = "es"
         session = boto3.Session()
 
@@ -61,13 +394,22 @@ class ESConnection:
         self.aws_auth = AWS4Auth(credentials.access_key, credentials.secret_key, region, service)
 
         aes_client = Elasticsearch(
-            hosts=[self.endpoint],
+            hosts=self.hosts,
             http_auth=self.aws_auth,
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection,
+            **self.transport_settings
         )
 
+        # requests connections take no pool size, and always accept gzip responses
+        maxsize = self.transport_settings.get("maxsize")
+        if maxsize:
+            from requests.adapters import HTTPAdapter
+
+            for connection in aes_client.transport.connection_pool.connections:
+                connection.session.mount("https://", HTTPAdapter(pool_maxsize=maxsize))
+
         return aes_client
 
     def get_open_distro_client(self):
@@ -76,7 +418,13 @@ class ESConnection:
         ssl_context.verify_mode = ssl.CERT_NONE
 
         open_distro_client = Elasticsearch(
-            [self.endpoint], http_auth=self.http_auth, verify_certs=False, ssl_context=ssl_context
+            self.hosts,
+            http_auth=self.http_auth,
+            verify_certs=False,
+            ssl_context=ssl_context,
+            connection_class=CancellableHttpConnection,
+            cancel_event=self.cancel_event,
+            **self.transport_settings
         )
 
         return open_distro_client
@@ -86,18 +434,50 @@ class ESConnection:
         sql_plugin_name_list = ["opendistro-sql", "opendistro_sql"]
         return any(x in self.plugins for x in sql_plugin_name_list)
 
-    def set_connection(self, is_reconnect=False):
-        urllib3.disable_warnings()
-        logging.captureWarnings(True)
-
+    def build_client(self):
+        """Build the kind of client endpoint needs: Open Distro with authentication, AWS, or plain Elasticsearch."""
         if self.http_auth:
             es_client = self.get_open_distro_client()
 
-        elif str(self.endpoint).endswith("es.amazonaws.com"):
+        elif str(self.hosts[0]).endswith("es.amazonaws.com"):
             es_client = self.get_aes_client()
 
         else:
-            es_client = Elasticsearch([self.endpoint], verify_certs=True)
+            es_client = Elasticsearch(
+                self.hosts,
+                verify_certs=True,
+                connection_class=CancellableHttpConnection,
+                cancel_event=self.cancel_event,
+                **self.transport_settings
+            )
+
+        transport = es_client.transport
+        transport.deserializer = ProfilingDeserializer(transport.deserializer, self.request_stats)
+        return es_client
+
+    def send(self, **kwargs):
+        """Send a request with the client, and add the time it takes to request_stats."""
+        start = time.perf_counter()
+        try:
+            return self.client.transport.perform_request(**kwargs)
+        finally:
+            self.request_stats.request_time += time.perf_counter() - start
+
+    def set_connection(self, is_reconnect=False):
+        urllib3.disable_warnings()
+        logging.captureWarnings(True)
+
+        es_client = self.build_client()
+
+        # skip all round trips to the cluster if its metadata is cached. Connection is checked by the first query.
+        metadata = self.metadata_cache.get(self.endpoint) if self.metadata_cache and not is_reconnect else None
+        if metadata:
+            self.plugins = metadata["plugins"]
+            self.es_version = metadata["es_version"]
+            self.indices_list = metadata["indices"]
+            self.client = es_client
+            self.is_metadata_cached = True
+            return
 
         # check connection. check Open Distro Elasticsearch SQL plugin availability.
         try:
@@ -115,6 +495,8 @@ class ESConnection:
             self.es_version = info["version"]["number"]
             self.client = es_client
             self.get_indices()
+            self.is_metadata_cached = False
+            self.save_metadata()
 
         except ConnectionError as error:
             if is_reconnect:
@@ -125,6 +507,68 @@ class ESConnection:
                 click.echo(repr(error))
                 sys.exit(0)
 
+    def refresh_metadata(self):
+        """Fetch plugins, version and indices from the cluster again, and update the metadata cache.
+
+        Safe to run in a background thread, a failed refresh keeps the current metadata.
+        """
+        try:
+            if self.is_sql_plugin_installed(self.client):
+                self.es_version = self.client.info()["version"]["number"]
+                self.get_indices()
+                self.is_metadata_cached = False
+                self.save_metadata()
+        except TransportError:
+            pass
+
+    def reconnect(self):
+        """Connect to the cluster again after a connection error. Plugins and indices are fetched again only if version
+        of the cluster changed, such as after an upgrade.
+
+        :raises ConnectionError: if the cluster is still unreachable
+        """
+        es_client = self.build_client()
+        if es_client.info()["version"]["number"] == self.es_version:
+            self.client = es_client
+        else:
+            self.set_connection(is_reconnect=True)
+
+    def send_with_retry(self, send, is_retryable=True):
+        """Call send(), and call it again after reconnecting, with jittered exponential backoff of retry_policy, if it
+        raises ConnectionError. Waiting is interrupted by cancel_query.
+
+        :param send: function sending a request
+        :param is_retryable: if False, connection errors are raised right away
+        :return: what send returns
+        :raises ConnectionError: once retries are used up
+        """
+        policy = self.retry_policy
+        for attempt in itertools.count(1):
+            try:
+                return send()
+            except ConnectionError:
+                if not is_retryable or attempt > policy.retries:
+                    raise
+
+            delay = random.uniform(0, min(policy.backoff * 2 ** (attempt - 1), policy.max_backoff))
+            click.secho(
+                message="Connection lost, retrying in %.1fs (%d/%d)" % (delay, attempt, policy.retries),
+                fg="yellow",
+                err=True,
+            )
+            if self.cancel_event.wait(delay):
+                raise QueryCancelled("N/A", "Query cancelled")
+
+            try:
+                self.reconnect()
+            except ConnectionError:
+                # next attempt fails too, and waits longer
+                pass
+
+    def save_metadata(self):
+        if self.metadata_cache:
+            self.metadata_cache.set(self.endpoint, self.plugins, self.es_version, self.indices_list)
+
     def handle_server_close_connection(self):
         """Used during CLI execution."""
         try:
@@ -135,7 +579,7 @@ class ESConnection:
             click.secho(message="Connection Failed. Check your ES is running and then come back", fg="red")
             click.secho(repr(reconnection_err), err=True, fg="red")
 
-    def execute_query(self, query, output_format="jdbc", explain=False, use_console=True):
+    def execute_query(self, query, output_format="jdbc", explain=False, use_console=True, use_cache=True, profile=None):
         """
         Handle user input, send SQL query and get response.
 
@@ -143,6 +587,8 @@ class ESConnection:
         :param query: SQL query
         :param output_format: jdbc/csv
         :param explain: if True, use _explain API.
+        :param use_cache: if False, send query to the cluster even if result cache has its result
+        :param profile: a QueryProfile to add network and decoding time, bytes and rows of the query to
         :return: raw http response
         """
 
@@ -150,19 +596,429 @@ class ESConnection:
         #  to save cost of http client.
         # deal with input
         final_query = query.strip().strip(";")
+        self.cancel_event.clear()
+        self.request_stats.reset()
 
+        data = None
         try:
-            data = self.client.transport.perform_request(
+            data = self._execute_query(final_query, output_format, explain, use_console, use_cache)
+            return data
+        finally:
+            if profile:
+                stats = self.request_stats
+                profile.add_requests(stats.request_time, stats.decode_time, stats.size)
+                profile.count_rows(data)
+
+    def _execute_query(self, final_query, output_format, explain, use_console, use_cache):
+        cache_key = None
+        # statements changing data are always sent
+        if self.result_cache and use_cache and (explain or READ_ONLY_REGEX.match(final_query)):
+            username = self.http_auth[0] if self.http_auth else None
+            cache_key = self.result_cache.key(self.endpoint, final_query, output_format, explain, username)
+            data = self.result_cache.get(cache_key)
+            if data is not None:
+                return data
+
+        def send():
+            return self.send(
                 url="/_opendistro/_sql/_explain" if explain else "/_opendistro/_sql/",
                 method="POST",
                 params=None if explain else {"format": output_format},
                 body={"query": final_query},
             )
+
+        try:
+            data = self.send_with_retry(send, explain or bool(READ_ONLY_REGEX.match(final_query)))
+            if cache_key:
+                self.result_cache.set(cache_key, data)
             return data
 
-        # handle client lost during execution
-        except ConnectionError:
-            if use_console:
-                self.handle_server_close_connection()
+        # client lost during execution, and retries didn't help
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
+        except RequestError as error:
+            click.secho(message=str(error.info["error"]), fg="red")
+
+    def stream_query(self, query, output_format, stream, use_console=True, profile=None):
+        """Send query, and write body of its response to stream in chunks as they arrive, without decoding it into
+        str or holding all of it in memory. Used for csv and raw output, which needs no formatting.
+
+        :param query: SQL query
+        :param output_format: csv/raw
+        :param stream: binary file-like object to write to
+        :param profile: a QueryProfile to add network time, bytes and rows of the query to. Time spent on writing to
+            stream is left out, it's not network time
+        :return: True if the whole body is written, False if query fails
+        """
+        final_query = query.strip().strip(";")
+        self.cancel_event.clear()
+
+        size = rows = 0
+        write_time = 0.0
+        last_chunk = b""
+        start = time.perf_counter()
+        try:
+            chunks = self.send_with_retry(
+                lambda: self.open_stream("/_opendistro/_sql/", {"format": output_format}, {"query": final_query}),
+                bool(READ_ONLY_REGEX.match(final_query)),
+            )
+            for chunk in chunks:
+                write_start = time.perf_counter()
+                stream.write(chunk)
+                write_time += time.perf_counter() - write_start
+                size += len(chunk)
+                rows += chunk.count(b"\n")
+                last_chunk = chunk
+            if last_chunk and not last_chunk.endswith(b"\n"):
+                # as click.echo ends output of other formats
+                stream.write(b"\n")
+                rows += 1
+            stream.flush()
+            return True
+
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
+        except RequestError as error:
+            click.secho(message=str(error.info["error"]), fg="red")
+        finally:
+            if profile:
+                profile.add_requests(time.perf_counter() - start - write_time, 0.0, size)
+                # lines after csv header
+                profile.rows = max(rows - 1, 0) if output_format == "csv" else rows
+
+        return False
+
+    def open_stream(self, url, params, body, chunk_size=STREAM_CHUNK_SIZE):
+        """POST body to url on a connection of the client, with the response left unread.
+
+        :return: generator of chunks of the response body, as bytes. Its http connection is released once the
+            generator is exhausted or closed
+        :raises TransportError: if the response has an error status, as the client raises it
+        :raises ConnectionError: if the request can't be sent
+        """
+        connection = self.client.transport.get_connection()
+        body = self.client.transport.serializer.dumps(body).encode("utf-8")
+
+        if isinstance(connection, Urllib3HttpConnection):
+            if connection.http_compress:
+                body = gzip.compress(body)
+            try:
+                response = connection.pool.urlopen(
+                    "POST",
+                    connection.url_prefix + url + "?" + urlencode(params),
+                    body,
+                    retries=urllib3.Retry(False),
+                    headers=connection.headers,
+                    timeout=connection.timeout,
+                    preload_content=False,
+                )
+            except urllib3.exceptions.HTTPError as error:
+                if self.cancel_event.is_set():
+                    raise QueryCancelled("N/A", "Query cancelled")
+                raise ConnectionError("N/A", str(error), error)
+            status, chunks, release = response.status, response.stream(chunk_size), response.release_conn
+        else:
+            # connection of AWS client, requests is imported already
+            import requests
+
+            try:
+                response = connection.session.post(
+                    connection.base_url + url, params=params, data=body, stream=True, timeout=connection.timeout
+                )
+            except requests.RequestException as error:
+                raise ConnectionError("N/A", str(error), error)
+            status, chunks, release = response.status_code, response.iter_content(chunk_size), response.close
+
+        if not 200 <= status < 300:
+            try:
+                raw_data = b"".join(chunks).decode("utf-8", "replace")
+            finally:
+                release()
+            connection._raise_error(status, raw_data)
+
+        return self._read_stream(chunks, release)
+
+    def _read_stream(self, chunks, release):
+        try:
+            yield from chunks
+        except (urllib3.exceptions.HTTPError, OSError) as error:
+            if self.cancel_event.is_set():
+                raise QueryCancelled("N/A", "Query cancelled")
+            raise ConnectionError("N/A", str(error), error)
+        finally:
+            release()
+
+    def profile_search(self, query, use_console=True):
+        """Explain query to ES DSL, and run the DSL against _search of the indices it queries with profiling on, to
+        see where the cluster spends time on the query.
+
+        :param query: SQL query
+        :param use_console: use console to interact with user, otherwise it's single query
+        :return: raw _search response, with "profile" of every shard, or None if query can't be profiled
+        """
+        final_query = query.strip().strip(";")
+        dsl = self.execute_query(final_query, explain=True, use_console=use_console, use_cache=False)
+        if dsl is None:
+            # error is printed already
+            return None
+
+        indices = extract_tables(final_query)
+        if not indices or not isinstance(dsl, dict) or not SEARCH_BODY_KEYS.intersection(dsl):
+            click.secho(message="Only queries explained to a single search request can be profiled", fg="red")
+            return None
+
+        body = dict(dsl, profile=True)
+        try:
+            return self.send_with_retry(
+                lambda: self.send(url="/%s/_search" % ",".join(indices), method="POST", body=body)
+            )
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
         except RequestError as error:
             click.secho(message=str(error.info["error"]), fg="red")
+
+    def execute_query_pages(self, query, fetch_size, use_console=True, profile=None, lazy=False):
+        """
+        Send SQL query with cursor pagination, and yield response pages one by one.
+
+        Only the first page carries "schema" and "total", following pages carry "datarows" and the "cursor" to
+        continue with. If the caller stops iterating before the last page, the cursor is closed on the server.
+
+        :param query: SQL query
+        :param fetch_size: number of rows in each page, page_sizer.fetch_size(query) picks one fitting the indices
+        :param use_console: use console to interact with user, otherwise it's single query
+        :param profile: a QueryProfile to add network and decoding time, bytes and rows of all pages to
+        :param lazy: if True, pages are LazyPage, whose "datarows" is an iterator decoding rows as they are consumed
+        :return: generator of raw http responses in jdbc format
+        :raises QueryFailed: if a page can't be fetched, after the error is printed
+        """
+        final_query = query.strip().strip(";")
+        body = {"query": final_query, "fetch_size": fetch_size}
+        page = None
+        rows = 0
+        # pages may be fetched from different threads, each with request_stats of its own
+        spent = {"request_time": 0.0, "decode_time": 0.0, "size": 0}
+        self.cancel_event.clear()
+
+        def send():
+            stats = self.request_stats
+            stats.reset()
+            stats.lazy_rows = lazy
+            try:
+                return self.send(url="/_opendistro/_sql/", method="POST", params={"format": "jdbc"}, body=body)
+            finally:
+                stats.lazy_rows = False
+                for key in spent:
+                    spent[key] += getattr(stats, key)
+
+        try:
+            while True:
+                page = self.send_with_retry(
+                    send,
+                    # a lost page can't be fetched again, cursor may have moved on
+                    "cursor" not in body and bool(READ_ONLY_REGEX.match(final_query)),
+                )
+                page_time, page_size = self.request_stats.request_time, self.request_stats.size
+                yield page
+
+                # caller is done with the page, rows of a lazy page are all decoded by now
+                page_rows = count_datarows(page)
+                rows += page_rows
+                self.page_sizer.record(final_query, page_time, page_size, page_rows)
+                cursor = page.get("cursor")
+                page = None
+                if not cursor:
+                    break
+                body = {"cursor": cursor}
+
+        # client lost during execution, and retries didn't help
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
+            raise QueryFailed("N/A", message, error)
+        except RequestError as error:
+            click.secho(message=str(error.info["error"]), fg="red")
+            raise QueryFailed("N/A", str(error.info["error"]), error)
+        finally:
+            # caller stopped in the middle of result set
+            if page is not None:
+                rows += count_datarows(page)
+                cursor = page.get("cursor")
+                if cursor:
+                    self.close_cursor(cursor)
+            if profile:
+                profile.add_requests(spent["request_time"], spent["decode_time"], spent["size"])
+                profile.rows = rows
+
+    def execute_query_slices(self, query, slices, fetch_size, use_console=True, profile=None):
+        """Fetch result of a plain SELECT ... FROM index query in parallel, with a sliced scroll of ES DSL explained from
+        it, so that export throughput scales with shards of the index instead of being bound to one cursor.
+
+        Each slice is scrolled by a thread of its own, and pages are yielded as they arrive, in no particular order.
+        Rows are taken from _source of hits, in columns of the schema the SQL plugin gives to the query.
+
+        :param query: SQL query
+        :param slices: number of slices fetched at the same time
+        :param fetch_size: number of hits in each page of a slice
+        :param use_console: use console to interact with user, otherwise it's single query
+        :param profile: a QueryProfile to add rows of all slices to
+        :return: generator of jdbc pages, the first one carries schema, or None if query can't be sliced. It raises
+            QueryFailed if a page can't be fetched, after the error is printed
+        """
+        final_query = query.strip().strip(";")
+        dsl = self.execute_query(final_query, explain=True, use_console=use_console, use_cache=False)
+        if dsl is None:
+            # error is printed already
+            return None
+
+        indices = extract_tables(final_query)
+        if (
+            not indices
+            or not isinstance(dsl, dict)
+            or not SEARCH_BODY_KEYS.intersection(dsl)
+            or {"aggregations", "sort"}.intersection(dsl)
+            or LIMIT_REGEX.search(final_query)
+        ):
+            click.secho(
+                message="Only plain SELECT ... FROM index queries, without LIMIT, ORDER BY, GROUP BY or joins, can be "
+                "exported in slices",
+                fg="red",
+            )
+            return None
+
+        # schema from the first page of a cursor, which is closed right away
+        pages = self.execute_query_pages(final_query, fetch_size=1, use_console=use_console)
+        first_page = next(pages, None)
+        pages.close()
+        if not first_page:
+            return None
+
+        schema = first_page["schema"]
+        source_fields = dsl.get("_source", {})
+        source_fields = source_fields.get("includes") if isinstance(source_fields, dict) else None
+        if not source_fields or len(source_fields) != len(schema):
+            source_fields = [field["name"] for field in schema]
+
+        # whole index is scrolled, "from" and "size" of DSL are the default limit of the SQL plugin
+        body = {key: value for key, value in dsl.items() if key not in ("from", "size")}
+        body["size"] = fetch_size
+        return self._fetch_slices(",".join(indices), body, slices, schema, source_fields, use_console, profile)
+
+    def _fetch_slices(self, index, body, slices, schema, source_fields, use_console, profile):
+        results = queue.Queue(maxsize=slices * 2)
+        stop = threading.Event()
+
+        def put(item):
+            # give up once consumer stopped, instead of blocking on a full queue
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def fetch(slice_id):
+            try:
+                for hits in self.scroll(index, dict(body, slice={"id": slice_id, "max": slices}), stop):
+                    rows = [
+                        [get_source_field(hit.get("_source", {}), field) for field in source_fields] for hit in hits
+                    ]
+                    put(rows)
+            except TransportError as error:
+                put(error)
+            finally:
+                put(None)
+
+        executor = ThreadPoolExecutor(max_workers=slices)
+        rows = 0
+        try:
+            for slice_id in range(slices):
+                executor.submit(fetch, slice_id)
+
+            yield {"schema": schema, "datarows": []}
+
+            finished = 0
+            while finished < slices:
+                item = results.get()
+                if item is None:
+                    finished += 1
+                elif isinstance(item, TransportError):
+                    raise item
+                else:
+                    rows += len(item)
+                    yield {"datarows": item}
+
+        except ConnectionError as error:
+            message = "Connection Failed. Check your ES is running and then come back"
+            click.secho(message=message, fg="red", err=not use_console)
+            click.secho(repr(error), err=True, fg="red")
+            raise QueryFailed("N/A", message, error)
+        except RequestError as error:
+            click.secho(message=str(error.info["error"]), fg="red")
+            raise QueryFailed("N/A", str(error.info["error"]), error)
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+            if profile:
+                profile.rows = rows
+
+    def scroll(self, index, body, stop=None):
+        """Search index with scroll API, and yield hits page by page. Scroll context is cleared once all hits are
+        fetched, or stop is set.
+        """
+        scroll_id = None
+        try:
+            response = self.send(
+                url="/%s/_search" % index, method="POST", params={"scroll": SCROLL_KEEP_ALIVE}, body=body
+            )
+            while True:
+                scroll_id = response.get("_scroll_id")
+                hits = response["hits"]["hits"]
+                if not hits:
+                    break
+
+                yield hits
+                if stop and stop.is_set():
+                    break
+                response = self.send(
+                    url="/_search/scroll", method="POST", body={"scroll": SCROLL_KEEP_ALIVE, "scroll_id": scroll_id}
+                )
+
+        finally:
+            if scroll_id:
+                try:
+                    self.client.transport.perform_request(
+                        url="/_search/scroll", method="DELETE", body={"scroll_id": [scroll_id]}
+                    )
+                except TransportError:
+                    # scroll expires on the server anyway
+                    pass
+
+    def cancel_query(self):
+        """Cancel queries in flight from another thread, by closing their http connections.
+
+        The threads sending them get QueryCancelled. Requests of AWS clients can't be aborted in flight, their
+        connections are closed once the response arrives.
+        """
+        self.cancel_event.set()
+
+        for connection in self.client.transport.connection_pool.connections:
+            if isinstance(connection, CancellableHttpConnection):
+                connection.abort()
+            else:
+                connection.close()
+
+    def close_cursor(self, cursor):
+        """Release a cursor on the server before all of its pages are fetched."""
+        try:
+            self.client.transport.perform_request(url="/_opendistro/_sql/close", method="POST", body={"cursor": cursor})
+        except TransportError:
+            # cursor expires on the server anyway
+            pass
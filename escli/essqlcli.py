@@ -15,42 +15,60 @@ limitations under the License.
 from __future__ import unicode_literals
 
 import click
+import concurrent.futures
+import itertools
 import re
 import pyfiglet
 import os
 import json
+import threading
+import time
 
-from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.enums import DEFAULT_BUFFER
 from prompt_toolkit.shortcuts import PromptSession
 from prompt_toolkit.filters import HasFocus, IsDone
 from prompt_toolkit.lexers import PygmentsLexer
 from prompt_toolkit.layout.processors import ConditionalProcessor, HighlightMatchingBracketProcessor
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.history import FileHistory
 from pygments.lexers.sql import SqlLexer
+from cli_helpers.tabular_output import TabularOutputFormatter
 
-from .config import get_config, config_location
-from .esconnection import ESConnection
+from .batch import read_statements, run_batch
+from .cache import MetadataCache, get_result_cache
+from .config import get_config
+from .esconnection import LIMIT_REGEX, ESConnection, QueryFailed, get_retry_policy, get_transport_settings
 from .esbuffer import es_is_multiline
+from .escompleter import ESCompleter
 from .esstyle import style_factory, style_factory_output
 from .formatter import Formatter
-from .utils import OutputSettings
+from .history import AutoSuggestFromSqliteHistory, get_history
+from .profiler import QueryProfile, init_logging, summarize_search_profile
+from .utils import OutputSettings, extract_tables, split_statements
 from .__init__ import __version__
 
 
 # Ref: https://stackoverflow.com/questions/30425105/filter-special-chars-such-as-color-codes-from-shell-output
 COLOR_CODE_REGEX = re.compile(r"\x1b(\[.*?[@-~]|\].*?(\x07|\x1b\\))")
 
+# queries fetched page by page with a cursor in the CLI, if they have no LIMIT
+SELECT_REGEX = re.compile(r"^\s*select\b", re.IGNORECASE)
+
+# max number of statements of a script sent at the same time
+SCRIPT_CONCURRENCY = 4
+
+# frames of the spinner shown while waiting for a query, and seconds between frames
+SPINNER_FRAMES = "|/-\\"
+SPINNER_INTERVAL = 0.1
+
 click.disable_unicode_literals_warning = True
 
 
 class ESSqlCli:
     """ESSqlCli instance is used to build and run the ES SQL CLI."""
 
-    def __init__(self, esclirc_file=None, always_use_pager=False):
+    def __init__(self, esclirc_file=None, always_use_pager=False, transport_overrides=None):
         # Load conf file
         config = self.config = get_config(esclirc_file)
+        init_logging(config)
         literal = self.literal = self._get_literals()
 
         self.prompt_app = None
@@ -65,19 +83,37 @@ class ESSqlCli:
         self.multi_line = config["main"].as_bool("multi_line")
         self.multiline_mode = config["main"].get("multi_line_mode", "escli")
         self.null_string = config["main"].get("null_string", "null")
-        self.history_file = config["main"]["history_file"]
+        self.row_limit = config["main"].as_int("row_limit")
+        self.history = None
         self.style_output = style_factory_output(self.syntax_style, self.cli_style)
+        self.metadata_cache = MetadataCache(ttl=config["main"].as_int("metadata_cache_ttl"))
+        self.result_cache = get_result_cache(config)
+        self.transport_settings = get_transport_settings(config, **(transport_overrides or {}))
+        self.retry_policy = get_retry_policy(config)
+        self.output_settings = None
+        self.timing = False
+        self.special_commands = {
+            "\\refresh": self.refresh_metadata,
+            "\\nocache": self.run_query_without_cache,
+            "\\timing": self.toggle_timing,
+            "\\searchprofile": self.profile_search,
+            "\\history": self.search_history,
+            "\\slowest": self.show_slowest,
+            "\\i": self.run_script_file,
+        }
+        self.query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def build_completer(self):
+        return ESCompleter(
+            self.keywords_list, self.functions_list, self.es_executor.indices_list, self.es_executor.get_fields
+        )
 
     def build_cli(self):
-        # TODO: Optimize index suggestion to serve indices options only at the needed position, such as 'from'
         # set completer
-        indices_list = self.es_executor.indices_list
-        sql_completer = WordCompleter(self.keywords_list + self.functions_list + indices_list, ignore_case=True)
+        sql_completer = self.build_completer()
 
         # set history
-        if self.history_file == "default":
-            self.history_file = config_location() + "history"
-        history = FileHistory(os.path.expanduser(self.history_file))
+        history = self.history = get_history(self.config, self.es_executor.endpoint)
 
         # https://stackoverflow.com/a/13726418 denote multiple unused arguments of callback in Python
         def get_continuation(width, *_):
@@ -92,7 +128,7 @@ class ESSqlCli:
             style=style_factory(self.syntax_style, self.cli_style),
             prompt_continuation=get_continuation,
             multiline=es_is_multiline(self),
-            auto_suggest=AutoSuggestFromHistory(),
+            auto_suggest=AutoSuggestFromSqliteHistory(),
             input_processors=[
                 ConditionalProcessor(
                     processor=HighlightMatchingBracketProcessor(chars="[](){}"),
@@ -112,7 +148,7 @@ class ESSqlCli:
         """
         self.prompt_app = self.build_cli()
 
-        settings = OutputSettings(
+        self.output_settings = OutputSettings(
             max_width=self.prompt_app.output.get_size().columns,
             style_output=self.style_output,
             table_format=self.table_format,
@@ -137,22 +173,230 @@ class ESSqlCli:
                 break  # Control-D pressed.
 
             try:
-                output = self.es_executor.execute_query(text)
-                if output:
-                    formatter = Formatter(settings)
-                    formatted_output = formatter.format_output(output)
-                    self.echo_via_pager("\n".join(formatted_output))
+                if text.strip().startswith("\\"):
+                    self.execute_special_command(text.strip())
+                    continue
+
+                statements = split_statements(text)
+                if len(statements) > 1:
+                    self.run_script(statements)
+                else:
+                    self.run_query(text)
 
             except Exception as e:
                 print(repr(e))
 
         print("See you next search!")
 
-    def is_too_wide(self, line):
+    def run_query(self, query, use_cache=True):
+        """Execute query and print its formatted result, followed by time spent in each phase if timing is on.
+
+        SELECTs from indices without LIMIT are fetched page by page with a cursor, sized by page_sizer of the
+        connection. Before more than row_limit rows are fetched, user is asked whether to fetch all of them, or only
+        the first row_limit rows.
+        """
+        profile = QueryProfile(query)
+        pages = None
+        row_limit = None
+
+        limit = LIMIT_REGEX.search(query)
+        if limit and not self.confirm_rows(int(limit.group(1))):
+            query = query[: limit.start(1)] + str(self.row_limit) + query[limit.end(1) :]
+
+        if self.row_limit and not limit and SELECT_REGEX.match(query) and extract_tables(query):
+            if self.result_cache and use_cache:
+                # cursor pages are not cached
+                output = self.execute_in_background(query, use_cache=use_cache, profile=profile)
+            else:
+                fetch_size = min(self.es_executor.page_sizer.fetch_size(query), self.row_limit)
+                pages = self.es_executor.execute_query_pages(query, fetch_size=fetch_size, profile=profile)
+                start = time.perf_counter()
+                try:
+                    output = self.run_in_background(next, pages, None)
+                except QueryFailed:
+                    # error is printed already
+                    output = None
+                first_page_time = time.perf_counter() - start
+        else:
+            output = self.execute_in_background(query, use_cache=use_cache, profile=profile)
+
+        try:
+            if output:
+                if not limit and not self.confirm_rows(output["total"] if pages else output["size"]):
+                    row_limit = self.row_limit
+
+                formatter = Formatter(self.output_settings)
+                with profile.measure("format"):
+                    if pages:
+                        formatted_output = formatter.format_pages(itertools.chain([output], pages), row_limit)
+                    else:
+                        formatted_output = formatter.format_output(output, row_limit)
+                # rows beyond the first screenful are formatted as the pager reads them
+                with profile.measure("render"):
+                    self.echo_via_pager(formatted_output)
+
+        except QueryFailed:
+            # a page after the first one failed, error is printed already
+            output = None
+        finally:
+            if pages and output:
+                # closes cursor if not all pages are fetched, and adds network time of pages to profile
+                pages.close()
+                requests_time = profile.timings.get("network", 0.0) + profile.timings.get("decode", 0.0)
+                # pages after the first one are fetched while rendering
+                profile.add("render", -max(requests_time - first_page_time, 0.0))
+
+        profile.log()
+        if self.history:
+            # time spent in pager waiting for user is not the query's
+            duration = profile.total - profile.timings.get("render", 0.0)
+            self.history.record(duration, profile.rows, success=output is not None)
+        if self.timing:
+            click.echo(profile.report())
+
+    def run_script_file(self, path):
+        """Run SQL statements separated by semicolon from a file, e.g. "\\i script.sql". See run_script."""
+        if not path:
+            click.secho(message="Usage: \\i <file>", fg="red")
+            return
+
+        try:
+            statements = read_statements(os.path.expanduser(path))
+        except OSError as error:
+            click.secho(message="Can not read %s: %s" % (path, error.strerror), fg="red")
+            return
+
+        self.run_script(statements)
+
+    def run_script(self, statements):
+        """Run statements on the connection pool, SCRIPT_CONCURRENCY at a time, while the results before them are
+        formatted and printed, in the same order as statements. Statements which change data run alone, see
+        run_batch. Ctrl-C stops the statements which are not done yet.
+        """
+        formatter = Formatter(self.output_settings)
+        results = run_batch(self.es_executor, statements, SCRIPT_CONCURRENCY)
+        failures = 0
+        start = time.time()
+
+        try:
+            for query, output, elapsed, profile in results:
+                click.echo(query + ";")
+                if output:
+                    with profile.measure("format"):
+                        output = "\n".join(formatter.format_output(output))
+                    with profile.measure("render"):
+                        click.echo(output)
+                else:
+                    failures += 1
+                click.echo("Time: %.3fs\n" % elapsed)
+                profile.log()
+                if self.timing:
+                    click.echo(profile.report())
+
+        except KeyboardInterrupt:
+            self.es_executor.cancel_query()
+            results.close()
+            click.secho(message="Script cancelled", fg="red")
+            return
+
+        click.echo("Ran %d statements in %.3fs, %d failed" % (len(statements), time.time() - start, failures))
+
+    def confirm_rows(self, rows):
+        """Ask user before more than row_limit rows are fetched. Limit of 0 never asks.
+
+        :return: True if rows are fetched all
+        """
+        if not self.row_limit or rows <= self.row_limit:
+            return True
+
+        click.secho(message="The result has %d rows, more than row_limit of %d" % (rows, self.row_limit), fg="red")
+        return click.confirm("Do you want to fetch all of them? Otherwise only %d are fetched" % self.row_limit)
+
+    def toggle_timing(self, _=None):
+        """Turn on or off printing time spent in each phase of queries."""
+        self.timing = not self.timing
+        click.echo("Timing is %s." % ("on" if self.timing else "off"))
+
+    def search_history(self, text):
+        """Print previous queries containing all words of text, newest first, e.g. "\\history accounts age"."""
+        if not text:
+            click.secho(message="Usage: \\history <words>", fg="red")
+            return
+
+        queries = self.history.search(text)
+        self.echo_via_pager("\n\n".join(query + ";" for query in reversed(queries)) or "No queries found")
+
+    def show_slowest(self, limit):
+        """Print the slowest successful queries to current endpoint, with their duration and rows, e.g.
+        "\\slowest 20". By default, 10 queries are printed.
+        """
+        if limit and not limit.isdigit():
+            click.secho(message="Usage: \\slowest [number of queries]", fg="red")
+            return
+
+        entries = self.history.slowest(int(limit or 10), endpoint=self.es_executor.endpoint)
+        rows = [
+            ["%.3fs" % duration, rows, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)), query]
+            for duration, rows, started, _, query in entries
+        ]
+        formatter = TabularOutputFormatter(format_name=self.table_format)
+        self.echo_via_pager(formatter.format_output(rows, ["duration", "rows", "started", "query"], missing_value="-"))
+
+    def run_query_without_cache(self, query):
+        """Execute query on the cluster, even if result cache has its result, e.g. "\\nocache SELECT * FROM a"."""
+        self.run_query(query, use_cache=False)
+
+    def profile_search(self, query):
+        """Run ES DSL of query against _search with profiling on, and print time each shard spends on query and
+        aggregations, with the slowest components, e.g. "\\searchprofile SELECT * FROM a WHERE b = 1".
+        """
+        response = self.run_in_background(self.es_executor.profile_search, query)
+        if response:
+            self.echo_via_pager(summarize_search_profile(response))
+
+    def execute_in_background(self, query, use_cache=True, profile=None):
+        """Send query from a worker thread, and show elapsed time while waiting for it. Ctrl-C cancels the query by
+        closing its http connection.
+
+        :return: raw http response, or None if the query is cancelled
+        """
+        return self.run_in_background(self.es_executor.execute_query, query, use_cache=use_cache, profile=profile)
+
+    def run_in_background(self, function, *args, **kwargs):
+        """Call function of es_executor from a worker thread, as execute_in_background sends queries.
+
+        :return: what function returns, or None if it's cancelled
+        """
+        future = self.query_executor.submit(function, *args, **kwargs)
+        start = time.time()
+        is_spinning = False
+
+        try:
+            for frame in itertools.cycle(SPINNER_FRAMES):
+                try:
+                    return future.result(timeout=SPINNER_INTERVAL)
+                except concurrent.futures.TimeoutError:
+                    click.echo("\r%s %.1fs" % (frame, time.time() - start), nl=False, err=True)
+                    is_spinning = True
+
+        except KeyboardInterrupt:
+            self.es_executor.cancel_query()
+            click.secho(message="\r\x1b[KQuery cancelled", fg="red", err=True)
+            is_spinning = False
+
+        finally:
+            if is_spinning:
+                # erase spinner
+                click.echo("\r\x1b[K", nl=False, err=True)
+
+    def is_too_wide(self, line, columns=None):
         """Will this line be too wide to fit into terminal?"""
         if not self.prompt_app:
             return False
-        return len(COLOR_CODE_REGEX.sub("", line)) > self.prompt_app.output.get_size().columns
+        if columns is None:
+            columns = self.prompt_app.output.get_size().columns
+        # color codes only make a line look wider than it is
+        return len(line) > columns and len(COLOR_CODE_REGEX.sub("", line)) > columns
 
     def is_too_tall(self, lines):
         """Are there too many lines to fit into terminal?"""
@@ -161,19 +405,70 @@ class ESSqlCli:
         return len(lines) >= (self.prompt_app.output.get_size().rows - 4)
 
     def echo_via_pager(self, text, color=None):
-        lines = text.split("\n")
+        """Print output, through pager if it's too tall or too wide to fit into terminal.
+
+        Only the first screenful of lines is measured. If it overflows, the rest of the lines is piped to the pager as
+        they are generated, instead of being joined into one string first.
+
+        :param text: output string, or iterable of output lines which is consumed lazily
+        """
+        lines = iter(text.split("\n") if isinstance(text, str) else text)
         if self.always_use_pager:
-            click.echo_via_pager(text, color=color)
+            click.echo_via_pager(self._paged_lines(lines), color=color)
+            return
+
+        if not self.prompt_app:
+            click.echo("\n".join(lines), color=color)
+            return
+
+        size = self.prompt_app.output.get_size()
+        screen = list(itertools.islice(lines, max(size.rows - 4, 0)))
 
-        elif self.is_too_tall(lines) or any(self.is_too_wide(l) for l in lines):
-            click.echo_via_pager(text, color=color)
+        if self.is_too_tall(screen) or any(self.is_too_wide(line, size.columns) for line in screen):
+            click.echo_via_pager(self._paged_lines(itertools.chain(screen, lines)), color=color)
         else:
-            click.echo(text, color=color)
+            # whole output is in the first screenful
+            click.echo("\n".join(screen), color=color)
 
-    def connect(self, endpoint, http_auth=None):
-        self.es_executor = ESConnection(endpoint, http_auth)
+    @staticmethod
+    def _paged_lines(lines):
+        for line in lines:
+            yield line + "\n"
+
+    def execute_special_command(self, command):
+        """Run a command starting with backslash, such as "\\refresh", instead of sending it as SQL."""
+        name, _, arg = command.strip(";").partition(" ")
+        handler = self.special_commands.get(name)
+
+        if not handler:
+            click.secho(message="Unknown command %s. Commands: %s" % (name, ", ".join(self.special_commands)), fg="red")
+            return
+
+        handler(arg.strip())
+
+    def refresh_metadata(self, _=None):
+        """Fetch plugins, version and indices from the cluster again, and update index suggestion."""
+        self.es_executor.refresh_metadata()
+        self.prompt_app.completer = self.build_completer()
+        click.secho(message="Refreshed metadata of %d indices" % len(self.es_executor.indices_list), fg="green")
+
+    def connect(self, endpoint, http_auth=None, refresh=False):
+        """Connect to endpoint, using cached cluster metadata if any.
+
+        :param refresh: if True, ignore cached metadata and fetch it from the cluster
+        """
+        if refresh:
+            self.metadata_cache.invalidate(endpoint)
+
+        self.es_executor = ESConnection(
+            endpoint, http_auth, self.metadata_cache, self.result_cache, self.transport_settings, self.retry_policy
+        )
         self.es_executor.set_connection()
 
+        if self.es_executor.is_metadata_cached:
+            # keep the cache fresh for next start, without blocking this one
+            threading.Thread(target=self.es_executor.refresh_metadata, daemon=True).start()
+
     def _get_literals(self):
         """Parse "esliterals.json" with literal type of SQL "keywords" and "functions", which
         are SQL keywords and functions supported by Open Distro SQL Plugin.
@@ -15,11 +15,23 @@ limitations under the License.
 import click
 import itertools
 
+from io import StringIO
 from cli_helpers.tabular_output import TabularOutputFormatter
 from cli_helpers.tabular_output.preprocessors import format_numbers
+from pygments.formatters.terminal256 import Terminal256Formatter
+from pygments.token import Token
 
 click.disable_unicode_literals_warning = True
 
+# Number of rows used to measure column widths. Output with more rows is rendered row by row.
+STREAM_SAMPLE_SIZE = 1000
+# Table formats that can be rendered row by row
+STREAMING_FORMATS = ("psql", "vertical")
+# Same limit cli_helpers applies to fields in tabular output
+MAX_FIELD_WIDTH = 500
+# Types of values converted to cells by str() alone, a whole column at a time
+SIMPLE_TYPES = {str, int, float}
+
 
 class Formatter:
     """Formatter instance is used to format the data retrieved from Elasticsearch."""
@@ -29,18 +41,12 @@ class Formatter:
         self.settings = settings
         self.table_format = "vertical" if self.settings.is_vertical else self.settings.table_format
         self.max_width = self.settings.max_width
-
-        def format_array(val):
-            if val is None:
-                return self.settings.missingval
-            if not isinstance(val, list):
-                return val
-            return "[" + ",".join(str(format_array(e)) for e in val) + "]"
+        self.style_formatter = Terminal256Formatter(style=settings.style_output) if settings.style_output else None
 
         def format_arrays(field_data, headers, **_):
-            field_data = list(field_data)
-            for row in field_data:
-                row[:] = [format_array(val) if isinstance(val, list) else val for val in row]
+            field_data = (
+                [self.format_array(val) if isinstance(val, list) else val for val in row] for row in field_data
+            )
 
             return field_data, headers
 
@@ -55,19 +61,33 @@ class Formatter:
             "style": self.settings.style_output,
         }
 
-    def format_output(self, data):
+    def format_array(self, val):
+        if val is None:
+            return self.settings.missingval
+        if not isinstance(val, list):
+            return val
+        return "[" + ",".join(str(self.format_array(e)) for e in val) + "]"
+
+    def format_output(self, data, row_limit=None):
         """Format data.
 
+        Rows beyond the first STREAM_SAMPLE_SIZE are neither collected nor copied, they are rendered lazily with
+        column widths measured from the sample rows.
+
         :param data: raw data get from ES
+        :param row_limit: if given, rows after this many are neither formatted nor consumed
         :return: formatted output, it's either table or vertical format
         """
         formatter = TabularOutputFormatter(format_name=self.table_format)
 
         # parse response data
-        datarows = data["datarows"]
+        datarows = iter(data["datarows"])
         schema = data["schema"]
         total_hits = data["total"]
         cur_size = data["size"]
+        if row_limit is not None and cur_size > row_limit:
+            datarows = itertools.islice(datarows, row_limit)
+            cur_size = row_limit
         # unused data for now,
         fields = []
         types = []
@@ -77,7 +97,31 @@ class Formatter:
             fields.append(i["name"])
             types.append(i["type"])
 
-        output = formatter.format_output(datarows, fields, **self.output_kwargs)
+        output = None
+        is_streaming = False
+        if (
+            self.table_format == "psql"
+            and not self.style_formatter
+            and isinstance(data["datarows"], list)
+            and min(cur_size, len(data["datarows"])) <= STREAM_SAMPLE_SIZE
+        ):
+            # small result, which is in memory already. Larger ones are streamed, so that the first rows show up
+            # without copies of all cells being made first
+            datarows = data["datarows"][:cur_size]
+            output = self.format_columns(datarows, fields)
+
+        if output is None:
+            sample = list(itertools.islice(datarows, STREAM_SAMPLE_SIZE + 1))
+            is_streaming = len(sample) > STREAM_SAMPLE_SIZE and self.table_format in STREAMING_FORMATS
+
+            if is_streaming:
+                output = self.stream_output(sample, datarows, fields, self.table_format)
+            else:
+                if len(sample) > STREAM_SAMPLE_SIZE:
+                    sample.extend(datarows)
+                datarows = sample
+                output = formatter.format_output(datarows, fields, **self.output_kwargs)
+
         output_message = "fetched rows / total rows = %d/%d" % (cur_size, total_hits)
 
         # Open Distro for ES sql has a restriction of retrieving 200 rows of data by default
@@ -91,9 +135,145 @@ class Formatter:
         if len(first_line) > self.max_width:
             click.secho(message="Output longer than terminal width", fg="red")
             if click.confirm("Do you want to display data vertically for better visual effect?"):
-                output = formatter.format_output(datarows, fields, format_name="vertical", **self.output_kwargs)
+                if is_streaming:
+                    output = self.stream_output(sample, datarows, fields, "vertical")
+                else:
+                    output = formatter.format_output(datarows, fields, format_name="vertical", **self.output_kwargs)
                 output = itertools.chain([output_message], output)
 
-        # TODO: if decided to add row_limit. Refer to pgcli -> main -> line 866.
-
         return output
+
+    def format_columns(self, datarows, headers):
+        """Render an unstyled psql table column by column, byte for byte as the tabular formatter does.
+
+        Cells of a column are converted, measured and padded in batch, instead of one cell at a time through the
+        preprocessors. A column of strings and numbers needs no per cell Python code at all.
+
+        :param datarows: list of rows
+        :param headers: field names
+        :return: iterator of output lines, or None if a cell needs the tabular formatter, such as multi-line or
+            non-ASCII text whose display width may differ from its length
+        """
+        if not datarows or not headers or len(datarows[0]) != len(headers):
+            return None
+
+        columns = []
+        widths = []
+        for header, column in zip(headers, zip(*datarows)):
+            if set(map(type, column)) <= SIMPLE_TYPES:
+                cells = list(map(str, column))
+                if max(map(len, cells)) > MAX_FIELD_WIDTH:
+                    cells = self._to_cells(cells, MAX_FIELD_WIDTH)
+            else:
+                # nulls, arrays and objects
+                cells = self._to_cells(column, MAX_FIELD_WIDTH)
+
+            text = header + "".join(cells)
+            if not (text.isascii() and text.isprintable()) or len(header) > MAX_FIELD_WIDTH:
+                return None
+
+            width = max(len(header) + 2, max(map(len, cells)))
+            columns.append(list(map(str.ljust, cells, itertools.repeat(width))))
+            widths.append(width)
+
+        border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+        header_line = self._psql_row(headers, widths, Token.Output.Header)
+        separator = "|" + "+".join("-" * (width + 2) for width in widths) + "|"
+        rows = map("| {} |".format, map(" | ".join, zip(*columns)))
+
+        return itertools.chain([border, header_line, separator], rows, [border])
+
+    def stream_output(self, sample, datarows, headers, format_name):
+        """Render rows one at a time, in the same layout as the tabular formatter.
+
+        :param sample: list of the first rows, used to measure column widths
+        :param datarows: iterator of the remaining rows, it's not consumed until output is iterated
+        :param headers: field names
+        :param format_name: psql/vertical
+        :return: generator of output lines
+        """
+        if format_name == "vertical":
+            return self._stream_vertical(itertools.chain(sample, datarows), headers)
+
+        sample = [self._to_cells(row, MAX_FIELD_WIDTH) for row in sample]
+        widths = [len(header) + 2 for header in headers]
+        for row in sample:
+            widths = [max(width, len(cell)) for width, cell in zip(widths, row)]
+
+        rows = itertools.chain(sample, (self._to_cells(row, MAX_FIELD_WIDTH) for row in datarows))
+        return self._stream_psql(rows, headers, widths)
+
+    def _stream_psql(self, rows, headers, widths):
+        border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+
+        yield border
+        yield self._psql_row(headers, widths, Token.Output.Header)
+        yield "|" + "+".join("-" * (width + 2) for width in widths) + "|"
+        for i, row in enumerate(rows, 1):
+            # a cell wider than the sampled width overflows its column instead of being cut
+            yield self._psql_row(row, widths, Token.Output.OddRow if i % 2 else Token.Output.EvenRow)
+        yield border
+
+    def _psql_row(self, cells, widths, token):
+        padded = (self._style(cell, token) + " " * (width - len(cell)) for cell, width in zip(cells, widths))
+        return "| " + " | ".join(padded) + " |"
+
+    def _stream_vertical(self, rows, headers):
+        header_width = max(len(header) for header in headers)
+        headers = [self._style(header, Token.Output.Header) + " " * (header_width - len(header)) for header in headers]
+        separator = "-[ RECORD {n} ]" + "-" * 25 + "\n"
+
+        for i, row in enumerate(rows, 1):
+            token = Token.Output.OddRow if i % 2 else Token.Output.EvenRow
+            cells = (self._style(cell, token) for cell in self._to_cells(row))
+            yield separator.format(n=i) + "\n".join(header + " | " + cell for header, cell in zip(headers, cells))
+
+    def _to_cells(self, row, max_field_width=None):
+        """Convert values of a row to strings, as the preprocessors of the tabular formatter do."""
+        cells = []
+        for val in row:
+            if val is None:
+                cell = self.settings.missingval
+            elif isinstance(val, list):
+                cell = self.format_array(val)
+            else:
+                cell = str(val)
+            if max_field_width and len(cell) > max_field_width and "\n" not in cell:
+                cell = cell[: max_field_width - 3] + "..."
+            cells.append(cell)
+
+        return cells
+
+    def _style(self, text, token):
+        if not self.style_formatter:
+            return text
+
+        styled = StringIO()
+        self.style_formatter.format(((token, text),), styled)
+        return styled.getvalue()
+
+    def format_pages(self, pages, row_limit=None):
+        """Format data fetched page by page with a cursor.
+
+        Rows are chained lazily from the pages, instead of being collected into one list first.
+
+        :param pages: iterable of raw data pages, the first page carries schema and total hits
+        :param row_limit: if given, pages after the one holding this many rows are not fetched
+        :return: formatted output, it's either table or vertical format
+        """
+        pages = iter(pages)
+        first_page = next(pages, None)
+        if not first_page:
+            return iter([])
+
+        datarows = itertools.chain.from_iterable(page["datarows"] for page in itertools.chain([first_page], pages))
+        # cursor keeps fetching until all hits are retrieved. Keys are read one by one, since rows of lazily decoded
+        # pages are not decoded yet
+        data = {
+            "schema": first_page["schema"],
+            "datarows": datarows,
+            "total": first_page["total"],
+            "size": first_page["total"],
+        }
+
+        return self.format_output(data, row_limit)
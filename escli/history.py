@@ -0,0 +1,236 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
+from prompt_toolkit.history import History
+
+from .config import config_location, ensure_dir_exists
+
+# max number of entries loaded into memory at start, for up and down keys. Search and suggestion cover all entries.
+HISTORY_LOAD_LIMIT = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL,
+    endpoint TEXT,
+    started REAL NOT NULL,
+    duration REAL,
+    rows INTEGER,
+    success INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_query ON history (query);
+CREATE INDEX IF NOT EXISTS history_duration ON history (duration);
+"""
+
+# full text index of queries, kept in sync by triggers. Used if sqlite is built with FTS5.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(query, content='history', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS history_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, query) VALUES (new.id, new.query);
+END;
+CREATE TRIGGER IF NOT EXISTS history_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, query) VALUES ('delete', old.id, old.query);
+END;
+"""
+
+
+def get_history(config, endpoint=None):
+    """Get SqliteHistory of history_file in esclirc. Its database is the history file with ".db" appended, and
+    entries of the plain history file are imported into it once, when it's created.
+    """
+    history_file = config["main"]["history_file"]
+    if history_file == "default":
+        history_file = config_location() + "history"
+    history_file = os.path.expanduser(history_file)
+
+    return SqliteHistory(
+        history_file + ".db",
+        endpoint=endpoint,
+        load_limit=config["main"].as_int("history_size") if "history_size" in config["main"] else HISTORY_LOAD_LIMIT,
+        legacy_file=history_file,
+    )
+
+
+class SqliteHistory(History):
+    """History of queries in a SQLite database, with endpoint, duration, rows and success of each of them.
+
+    Queries are indexed, so prefix and full text search don't scan all of them, and only the latest load_limit
+    entries are loaded at start.
+    """
+
+    def __init__(self, filename, endpoint=None, load_limit=HISTORY_LOAD_LIMIT, legacy_file=None):
+        """Initialize a SqliteHistory instance.
+
+        :param filename: path of the database, it's created if missing
+        :param endpoint: endpoint recorded with queries stored from now on
+        :param load_limit: max number of entries loaded at start
+        :param legacy_file: history file of prompt_toolkit FileHistory, imported when the database is created
+        """
+        super(SqliteHistory, self).__init__()
+        self.filename = filename
+        self.endpoint = endpoint
+        self.load_limit = load_limit
+        self.last_id = None
+        # prompt_toolkit may load history from another thread
+        self.lock = threading.Lock()
+
+        is_new = not os.path.exists(filename)
+        if filename != ":memory:":
+            ensure_dir_exists(filename)
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # no FTS5, full text search falls back to scanning
+            self.has_fts = False
+
+        if is_new and legacy_file and os.path.exists(legacy_file):
+            self.import_file(legacy_file)
+
+    def load_history_strings(self):
+        """Yield the latest load_limit queries, newest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT query FROM history ORDER BY id DESC LIMIT ?", (self.load_limit,)
+            ).fetchall()
+
+        for (query,) in rows:
+            yield query
+
+    def store_string(self, string):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO history (query, endpoint, started) VALUES (?, ?, ?)", (string, self.endpoint, time.time())
+            )
+            self.last_id = cursor.lastrowid
+
+    def record(self, duration, rows=None, success=True):
+        """Record duration in seconds, rows and success of the query stored last."""
+        if self.last_id is None:
+            return
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE history SET duration = ?, rows = ?, success = ? WHERE id = ?",
+                (duration, rows, int(success), self.last_id),
+            )
+
+    def search_prefix(self, prefix, limit=1):
+        """Get queries starting with prefix, newest first. Prefix is matched case sensitively, by range of the index."""
+        if not prefix:
+            return []
+
+        # strings starting with prefix sort between prefix itself and prefix followed by the largest code point
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT query FROM history WHERE query >= ? AND query < ? GROUP BY query ORDER BY MAX(id) DESC "
+                "LIMIT ?",
+                (prefix, prefix + "\U0010ffff", limit),
+            ).fetchall()
+
+        return [query for (query,) in rows]
+
+    def search(self, text, limit=20):
+        """Get queries containing all words of text, newest first."""
+        words = text.split()
+        if not words:
+            return []
+
+        if self.has_fts:
+            # each word is quoted, so SQL keywords and punctuation in it aren't taken as FTS syntax
+            match = " ".join('"%s"' % word.replace('"', '""') for word in words)
+            sql = (
+                "SELECT history.query FROM history_fts JOIN history ON history.id = history_fts.rowid "
+                "WHERE history_fts MATCH ? GROUP BY history.query ORDER BY MAX(history.id) DESC LIMIT ?"
+            )
+            params = (match, limit)
+        else:
+            sql = "SELECT query FROM history WHERE %s GROUP BY query ORDER BY MAX(id) DESC LIMIT ?" % " AND ".join(
+                ["query LIKE ?"] * len(words)
+            )
+            params = tuple("%" + word + "%" for word in words) + (limit,)
+
+        with self.lock:
+            return [query for (query,) in self.connection.execute(sql, params).fetchall()]
+
+    def slowest(self, limit=10, endpoint=None):
+        """Get (duration, rows, started, endpoint, query) of the slowest successful queries, slowest first.
+
+        :param endpoint: only queries to this endpoint, by default queries to all endpoints
+        """
+        sql = "SELECT duration, rows, started, endpoint, query FROM history WHERE success = 1"
+        params = ()
+        if endpoint:
+            sql += " AND endpoint = ?"
+            params = (endpoint,)
+
+        with self.lock:
+            return self.connection.execute(sql + " ORDER BY duration DESC LIMIT ?", params + (limit,)).fetchall()
+
+    def import_file(self, filename):
+        """Import entries of a prompt_toolkit FileHistory file, where each line of an entry is prefixed with "+" and
+        each entry follows a "# <timestamp>" comment line.
+        """
+        entries = []
+        lines = []
+
+        def add_entry():
+            if lines:
+                entries.append("\n".join(lines))
+                lines.clear()
+
+        with open(filename, "rb") as f:
+            for line in f:
+                line = line.decode("utf-8", errors="replace").rstrip("\n")
+                if line.startswith("+"):
+                    lines.append(line[1:])
+                else:
+                    add_entry()
+        add_entry()
+
+        mtime = os.path.getmtime(filename)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO history (query, started) VALUES (?, ?)", ((entry, mtime) for entry in entries)
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class AutoSuggestFromSqliteHistory(AutoSuggest):
+    """Suggest the rest of the newest query starting with the text typed so far, with an indexed search of all history
+    entries, instead of scanning the entries in memory as AutoSuggestFromHistory does.
+    """
+
+    def get_suggestion(self, buffer, document):
+        history = buffer.history
+        text = document.text
+
+        if text.strip() and isinstance(history, SqliteHistory):
+            for query in history.search_prefix(text):
+                # only the rest of current line is shown
+                rest = query[len(text) :].split("\n", 1)[0]
+                if rest:
+                    return Suggestion(rest)
+
+        return None
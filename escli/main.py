@@ -14,17 +14,156 @@ limitations under the License.
 """
 from __future__ import unicode_literals
 
+import asyncio
 import click
+import importlib.util
 import sys
 
-from .config import config_location
-from .esconnection import ESConnection
+from .batch import read_statements, run_batch, run_batch_async
+from .cache import MetadataCache, get_result_cache
+from .config import config_location, get_config
+from .esconnection import ESConnection, QueryFailed, SELECTORS, get_retry_policy, get_transport_settings
+from .profiler import QueryProfile, init_logging, summarize_search_profile
 from .utils import OutputSettings
-from .essqlcli import ESSqlCli
-from .formatter import Formatter
+from .writers import BUFFER_SIZE, WRITERS, write_pages
+
+# formatter and essqlcli are imported where they are used, since they pull in cli_helpers, prompt_toolkit, pygments
+# and pyfiglet. Non-interactive mode needs none of them for csv and explain output.
 
 click.disable_unicode_literals_warning = True
 
+# page size of cursor used to export query result, if --fetch-size is not given
+EXPORT_FETCH_SIZE = 1000
+# output formats of the plugin written out as they are, without formatting
+PASSTHROUGH_FORMATS = ("csv", "raw")
+
+
+def echo_lines(lines):
+    """Write output line by line, without joining it into one string first."""
+    stdout = click.get_text_stream("stdout")
+    for line in lines:
+        stdout.write(line + "\n")
+    stdout.flush()
+
+
+def connect(endpoint, http_auth, esclirc, refresh=False, transport_overrides=None, concurrency=None, loop=None):
+    """Connect to endpoint for non-interactive mode, using cluster metadata cached on disk if any, and result cache
+    and http and retry settings configured in esclirc.
+
+    :param transport_overrides: http settings given in command line, see get_transport_settings
+    :param concurrency: number of queries sent at the same time, the connection pool keeps a connection for each of
+        them unless max_connections is set
+    :param loop: if given, connect an AsyncESConnection in this event loop running in another thread
+    """
+    config = get_config(esclirc)
+    init_logging(config)
+    metadata_cache = MetadataCache(ttl=config["main"].as_int("metadata_cache_ttl"))
+    if refresh:
+        metadata_cache.invalidate(endpoint)
+
+    transport_settings = get_transport_settings(config, **(transport_overrides or {}))
+    if concurrency:
+        transport_settings.setdefault("maxsize", concurrency)
+
+    if loop:
+        from .esasyncconnection import AsyncESConnection
+
+        es_executor = AsyncESConnection(
+            endpoint, http_auth, metadata_cache, get_result_cache(config), transport_settings, get_retry_policy(config)
+        )
+        if not asyncio.run_coroutine_threadsafe(es_executor.set_connection(), loop).result():
+            # error is printed already
+            sys.exit(0)
+        return es_executor
+
+    es_executor = ESConnection(
+        endpoint, http_auth, metadata_cache, get_result_cache(config), transport_settings, get_retry_policy(config)
+    )
+    es_executor.set_connection()
+
+    return es_executor
+
+
+def render_pages(profile, render):
+    """Call render, which fetches pages while writing them out, and add the time it spends on writing only to
+    "render" phase of profile.
+    """
+    requests_time = profile.timings.get("network", 0.0) + profile.timings.get("decode", 0.0)
+    with profile.measure("render"):
+        result = render()
+
+    # network and decoding time of pages is added to profile by execute_query_pages
+    profile.add("render", requests_time - profile.timings.get("network", 0.0) - profile.timings.get("decode", 0.0))
+    return result
+
+
+def finish_profile(profile, is_profile):
+    """Log profile of a query, and print it to stderr if --profile is given."""
+    profile.log()
+    if is_profile:
+        click.echo(profile.report(), err=True)
+
+
+def export(es_executor, query, export_format, output_file, fetch_size, profile=None, slices=None):
+    """Export result of query page by page to output_file, or stdout if it's None.
+
+    :param slices: if given, fetch result in this many slices at the same time, instead of one cursor
+    :return: exit code
+    """
+    if slices:
+        pages = es_executor.execute_query_slices(query, slices, fetch_size, use_console=False, profile=profile)
+        if pages is None:
+            # error is printed already
+            return 1
+    else:
+        pages = es_executor.execute_query_pages(query, fetch_size=fetch_size, use_console=False, profile=profile)
+
+    is_binary = WRITERS[export_format].is_binary
+
+    if output_file:
+        if is_binary:
+            stream = open(output_file, "wb", buffering=BUFFER_SIZE)
+        else:
+            stream = open(output_file, "w", buffering=BUFFER_SIZE, encoding="utf-8", newline="")
+    else:
+        stream = click.get_binary_stream("stdout") if is_binary else click.get_text_stream("stdout")
+
+    try:
+        count = write_pages(pages, export_format, stream)
+    except ImportError:
+        click.secho(message="pyarrow is required to export %s, run: pip install pyarrow" % export_format, fg="red")
+        return 1
+    except QueryFailed:
+        # error is printed already, output is incomplete
+        return 1
+    finally:
+        if output_file:
+            stream.close()
+
+    if output_file:
+        click.echo("Exported %d rows to %s" % (count, output_file), err=True)
+    return 0
+
+
+def passthrough(es_executor, query, output_format, output_file, profile=None):
+    """Write response of query to output_file, or stdout if it's None, chunk by chunk as it arrives.
+
+    :return: True if the whole response is written
+    """
+    if not output_file:
+        return es_executor.stream_query(query, output_format, click.get_binary_stream("stdout"), False, profile)
+
+    with open(output_file, "wb", buffering=BUFFER_SIZE) as stream:
+        return es_executor.stream_query(query, output_format, stream, False, profile)
+
+
+def get_formatter(is_vertical):
+    """Get formatter of jdbc output for non-interactive mode."""
+    from .formatter import Formatter
+
+    settings = OutputSettings(table_format="psql", is_vertical=is_vertical)
+    return Formatter(settings)
+
 
 @click.command()
 @click.argument("endpoint", default="http://localhost:9200")
@@ -43,7 +182,8 @@ click.disable_unicode_literals_warning = True
     "result_format",
     type=click.STRING,
     default="jdbc",
-    help="Specify format of output, jdbc/csv. By default, it's jdbc",
+    help="Specify format of output, jdbc/csv/raw. By default, it's jdbc. csv and raw output of single query is \
+         written out as it arrives, unless result cache of esclirc is used",
 )
 @click.option(
     "-v",
@@ -64,9 +204,155 @@ click.disable_unicode_literals_warning = True
     help="Always use pager to display output. If not specified, smart pager mode will be used according to the \
          length/width of output",
 )
-def cli(endpoint, query, explain, esclirc, result_format, is_vertical, username, password, always_use_pager):
+@click.option(
+    "-s",
+    "--fetch-size",
+    "fetch_size",
+    type=click.IntRange(min=1),
+    help="Fetch result page by page with a cursor of given size, and print rows as they arrive. Only used for \
+         non-interactive mode with jdbc format",
+)
+@click.option(
+    "-b",
+    "--batch",
+    "batch_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Run SQL statements separated by semicolon from a file concurrently, in non-interactive mode. Results are \
+         printed in the same order as statements, with time taken by each. Statements which change data run alone",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    "concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="Max number of statements running at the same time in batch mode. By default, it's 4",
+)
+@click.option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    default=False,
+    help="Send statements of batch mode with an asyncio http client, which keeps receiving results while previous \
+         ones are printed. Needs aiohttp installed",
+)
+@click.option(
+    "--refresh",
+    "refresh",
+    is_flag=True,
+    default=False,
+    help="Ignore cluster metadata cached on disk, and fetch it from the cluster again",
+)
+@click.option(
+    "--no-cache",
+    "no_cache",
+    is_flag=True,
+    default=False,
+    help="Send queries to the cluster even if result cache configured in esclirc has their results",
+)
+@click.option(
+    "--export",
+    "export_format",
+    type=click.Choice(sorted(WRITERS)),
+    help="Export result of single query page by page with a cursor, as ndjson, csv, Arrow IPC stream or Parquet. \
+         Arrow and Parquet need pyarrow installed",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File to export result, or csv/raw output of single query, to. By default, it's stdout",
+)
+@click.option(
+    "--slices",
+    "slices",
+    type=click.IntRange(min=2),
+    help="Export result of a plain SELECT ... FROM index query in this many slices fetched at the same time, with \
+         sliced scroll of its ES DSL. Rows are exported in no particular order",
+)
+@click.option(
+    "--http-compress/--no-http-compress",
+    "http_compress",
+    default=None,
+    help="Compress requests and responses with gzip. Overrides http_compress in esclirc",
+)
+@click.option(
+    "--timeout",
+    "timeout",
+    type=click.FloatRange(min=0),
+    help="Seconds to wait for a response before a request fails. Overrides timeout in esclirc",
+)
+@click.option(
+    "--max-connections",
+    "max_connections",
+    type=click.IntRange(min=1),
+    help="Max number of connections kept alive to each node. Overrides max_connections in esclirc",
+)
+@click.option(
+    "--max-retries",
+    "max_retries",
+    type=click.IntRange(min=0),
+    help="Times a request is retried on connection errors. Overrides max_retries in esclirc",
+)
+@click.option(
+    "--node-selector",
+    "node_selector",
+    type=click.Choice(sorted(SELECTORS)),
+    help="How a node is picked for each request, if endpoint has several nodes. Overrides node_selector in esclirc",
+)
+@click.option(
+    "--sniff/--no-sniff",
+    "sniff",
+    default=None,
+    help="Find all nodes of the cluster, and send requests to all of them. Overrides sniff in esclirc",
+)
+@click.option(
+    "--profile",
+    "is_profile",
+    is_flag=True,
+    default=False,
+    help="Print time spent in each phase of queries (connect, network, decode, format, render), with bytes and rows \
+         fetched, to stderr. Only used for non-interactive mode",
+)
+@click.option(
+    "--search-profile",
+    "search_profile",
+    is_flag=True,
+    default=False,
+    help="Run ES DSL explained from query against _search with profiling on, and print time each shard spends on \
+         query and aggregations, with the slowest components. Only used for non-interactive mode",
+)
+def cli(
+    endpoint,
+    query,
+    explain,
+    esclirc,
+    result_format,
+    is_vertical,
+    username,
+    password,
+    always_use_pager,
+    fetch_size,
+    batch_file,
+    concurrency,
+    use_async,
+    refresh,
+    no_cache,
+    export_format,
+    output_file,
+    slices,
+    http_compress,
+    timeout,
+    max_connections,
+    max_retries,
+    node_selector,
+    sniff,
+    is_profile,
+    search_profile,
+):
     """
-    Provide endpoint for Elasticsearch client.
+    Provide endpoint for Elasticsearch client, or endpoints of several nodes separated by comma.
     By default, it uses http://localhost:9200 to connect.
     """
 
@@ -75,28 +361,134 @@ def cli(endpoint, query, explain, esclirc, result_format, is_vertical, username,
     else:
         http_auth = None
 
+    transport_overrides = {
+        "http_compress": http_compress,
+        "timeout": timeout,
+        "max_connections": max_connections,
+        "max_retries": max_retries,
+        "node_selector": node_selector,
+        "sniff": sniff,
+    }
+
     # TODO add validation for endpoint to avoid the cost of connecting to some obviously invalid endpoint
 
+    if slices and not export_format:
+        click.secho(message="--slices is only used with --export", fg="red")
+        sys.exit(1)
+
+    # handle a file of queries without more interaction with user
+    if batch_file:
+        queries = read_statements(batch_file)
+        if use_async:
+            if not importlib.util.find_spec("aiohttp"):
+                click.secho(message="aiohttp is required by --async, run: pip install aiohttp", fg="red")
+                sys.exit(1)
+
+            from .esasyncconnection import start_event_loop
+
+            loop = start_event_loop()
+            es_executor = connect(endpoint, http_auth, esclirc, refresh, transport_overrides, concurrency, loop)
+            results = run_batch_async(
+                es_executor, queries, loop, concurrency, result_format, explain, use_cache=not no_cache
+            )
+        else:
+            es_executor = connect(endpoint, http_auth, esclirc, refresh, transport_overrides, concurrency)
+            results = run_batch(es_executor, queries, concurrency, result_format, explain, use_cache=not no_cache)
+
+        formatter = get_formatter(is_vertical) if result_format == "jdbc" and not explain else None
+        failures = 0
+
+        for query, output, elapsed, profile in results:
+            click.echo(query + ";")
+            if output:
+                if formatter:
+                    with profile.measure("format"):
+                        output = "\n".join(formatter.format_output(output))
+                with profile.measure("render"):
+                    click.echo(output)
+            else:
+                failures += 1
+            click.echo("Time: %.3fs\n" % elapsed)
+            finish_profile(profile, is_profile)
+
+        if use_async:
+            asyncio.run_coroutine_threadsafe(es_executor.close(), loop).result()
+        sys.exit(1 if failures else 0)
+
     # handle single query without more interaction with user
     if query:
-        es_executor = ESConnection(endpoint, http_auth)
-        es_executor.set_connection()
+        profile = QueryProfile(query)
+        with profile.measure("connect"):
+            # a connection for each slice
+            es_executor = connect(endpoint, http_auth, esclirc, refresh, transport_overrides, slices)
+
+        if search_profile:
+            response = es_executor.profile_search(query, use_console=False)
+            if response is None:
+                sys.exit(1)
+
+            click.echo("\n".join(summarize_search_profile(response)))
+            sys.exit(0)
+
+        if export_format and not explain:
+            exit_code = render_pages(
+                profile,
+                lambda: export(
+                    es_executor, query, export_format, output_file, fetch_size or EXPORT_FETCH_SIZE, profile, slices
+                ),
+            )
+            finish_profile(profile, is_profile)
+            sys.exit(exit_code)
+
+        if result_format in PASSTHROUGH_FORMATS and not explain and (no_cache or not es_executor.result_cache):
+            # body of the response is written out as it arrives, it's never decoded or held in memory
+            is_written = render_pages(
+                profile, lambda: passthrough(es_executor, query, result_format, output_file, profile)
+            )
+            finish_profile(profile, is_profile)
+            sys.exit(0 if is_written else 1)
+
+        if fetch_size and result_format == "jdbc" and not explain:
+            # stream rows page by page, so the whole result set never stays in memory
+            pages = es_executor.execute_query_pages(
+                query, fetch_size=fetch_size, use_console=False, profile=profile, lazy=True
+            )
+            try:
+                render_pages(profile, lambda: echo_lines(get_formatter(is_vertical).format_pages(pages)))
+                exit_code = 0
+            except QueryFailed:
+                # error is printed already, output is incomplete
+                exit_code = 1
+            finish_profile(profile, is_profile)
+            sys.exit(exit_code)
+
         if explain:
-            output = es_executor.execute_query(query, explain=True, use_console=False)
+            output = es_executor.execute_query(
+                query, explain=True, use_console=False, use_cache=not no_cache, profile=profile
+            )
         else:
-            output = es_executor.execute_query(query, output_format=result_format, use_console=False)
+            output = es_executor.execute_query(
+                query, output_format=result_format, use_console=False, use_cache=not no_cache, profile=profile
+            )
             if output and result_format == "jdbc":
-                settings = OutputSettings(table_format="psql", is_vertical=is_vertical)
-                formatter = Formatter(settings)
-                output = formatter.format_output(output)
-                output = "\n".join(output)
+                with profile.measure("format"):
+                    output = "\n".join(get_formatter(is_vertical).format_output(output))
+
+        if output is None:
+            # error is printed already
+            finish_profile(profile, is_profile)
+            sys.exit(1)
 
-        click.echo(output)
+        with profile.measure("render"):
+            click.echo(output)
+        finish_profile(profile, is_profile)
         sys.exit(0)
 
     # use console to interact with user
-    escli = ESSqlCli(esclirc_file=esclirc, always_use_pager=always_use_pager)
-    escli.connect(endpoint, http_auth)
+    from .essqlcli import ESSqlCli
+
+    escli = ESSqlCli(esclirc_file=esclirc, always_use_pager=always_use_pager, transport_overrides=transport_overrides)
+    escli.connect(endpoint, http_auth, refresh)
     escli.run_cli()
 
 
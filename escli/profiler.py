@@ -0,0 +1,217 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .config import config_location, ensure_dir_exists
+
+logger = logging.getLogger(__name__)
+
+# number of slowest query and aggregation components listed in summary of a search profile
+SLOWEST_COMPONENTS = 10
+# longer descriptions of components, such as queries with many clauses, are cut
+MAX_DESCRIPTION_WIDTH = 60
+
+
+class QueryProfile:
+    """Time spent in each phase of a query, in seconds, with bytes and rows it fetched.
+
+    Phases are "connect", "network" (http round trips, including time the server takes), "decode" (json decoding of
+    responses), "format" and "render", in order of appearance.
+    """
+
+    def __init__(self, query=None):
+        self.query = query
+        self.timings = OrderedDict()
+        self.bytes = 0
+        self.rows = None
+
+    @contextmanager
+    def measure(self, phase):
+        """Add time spent in the with block to phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def add(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def add_requests(self, request_time, decode_time, size):
+        """Add time and size of http requests, decoding time of their responses is split from network time."""
+        self.add("network", request_time - decode_time)
+        self.add("decode", decode_time)
+        self.bytes += size
+
+    def count_rows(self, data):
+        """Count rows of a raw response, jdbc or csv."""
+        if isinstance(data, dict) and "datarows" in data:
+            self.rows = len(data["datarows"])
+        elif isinstance(data, str):
+            # lines after csv header
+            self.rows = data.count("\n")
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+    def report(self):
+        """Get one line summary, such as "Time: 0.125s (network 0.100s, decode 0.005s, ...), 2048 bytes, 10 rows"."""
+        report = "Time: %.3fs" % self.total
+        if self.timings:
+            report += " (%s)" % ", ".join("%s %.3fs" % (phase, seconds) for phase, seconds in self.timings.items())
+        report += ", %d bytes" % self.bytes
+        if self.rows is not None:
+            report += ", %d rows" % self.rows
+        return report
+
+    def to_dict(self):
+        return {
+            "query": self.query,
+            "total": round(self.total, 6),
+            "phases": OrderedDict((phase, round(seconds, 6)) for phase, seconds in self.timings.items()),
+            "bytes": self.bytes,
+            "rows": self.rows,
+        }
+
+    def log(self):
+        logger.info("query profile", extra={"profile": self.to_dict()})
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as json lines, with fields of the query profile attached to them, if any."""
+
+    def format(self, record):
+        entry = OrderedDict(
+            [
+                ("time", self.formatTime(record)),
+                ("level", record.levelname),
+                ("logger", record.name),
+                ("message", record.getMessage()),
+            ]
+        )
+        entry.update(getattr(record, "profile", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+
+def init_logging(config):
+    """Write logs of escli to log_file of esclirc as json lines, at log_level. Level "NONE" disables logging."""
+    root_logger = logging.getLogger("escli")
+    if root_logger.handlers:
+        # initialized already
+        return
+
+    log_file = config["main"]["log_file"]
+    if log_file == "default":
+        log_file = config_location() + "log"
+    log_file = os.path.expanduser(log_file)
+    log_level = config["main"]["log_level"].upper()
+
+    if log_level == "NONE":
+        root_logger.addHandler(logging.NullHandler())
+        return
+
+    try:
+        ensure_dir_exists(log_file)
+        handler = logging.FileHandler(log_file)
+    except OSError:
+        # logging is not worth failing the CLI for
+        root_logger.addHandler(logging.NullHandler())
+        return
+
+    handler.setFormatter(JsonFormatter())
+    root_logger.addHandler(handler)
+    root_logger.setLevel(log_level)
+
+
+def summarize_search_profile(response, top=SLOWEST_COMPONENTS):
+    """Summarize profile of a _search response: time each shard spent on query, rewrite, collectors and aggregations,
+    and the slowest components of query and aggregation trees by their own time, excluding their children.
+
+    :param response: raw _search response of a request with "profile": true
+    :param top: number of slowest components to list
+    :return: list of output lines
+    """
+    shards = response.get("profile", {}).get("shards", [])
+    hits = response.get("hits", {}).get("total", 0)
+    if isinstance(hits, dict):
+        # {"value": 10, "relation": "eq"} since Elasticsearch 7
+        hits = hits.get("value", 0)
+
+    shard_rows = []
+    components = []
+    for shard in shards:
+        query_time = rewrite_time = collect_time = 0
+        for search in shard.get("searches", []):
+            query_time += sum(node["time_in_nanos"] for node in search.get("query", []))
+            rewrite_time += search.get("rewrite_time", 0)
+            collect_time += sum(collector["time_in_nanos"] for collector in search.get("collector", []))
+            for node in search.get("query", []):
+                components.extend(_self_times(node, "query", shard["id"]))
+
+        aggregations_time = sum(node["time_in_nanos"] for node in shard.get("aggregations", []))
+        for node in shard.get("aggregations", []):
+            components.extend(_self_times(node, "aggregation", shard["id"]))
+
+        shard_rows.append(
+            [shard["id"]] + [_millis(nanos) for nanos in (query_time, rewrite_time, collect_time, aggregations_time)]
+        )
+
+    lines = ["Took %dms on %d shards, %d hits" % (response.get("took", 0), len(shards), hits)]
+    if not shards:
+        return lines
+
+    lines.extend(_table(["shard", "query", "rewrite", "collect", "aggregations"], shard_rows))
+
+    components.sort(key=lambda component: component[0], reverse=True)
+    slowest = [[_millis(nanos)] + list(component) for nanos, *component in components[:top]]
+    lines.append("Slowest %d components, by time excluding their children:" % len(slowest))
+    lines.extend(_table(["self time", "kind", "type", "description", "shard"], slowest))
+
+    return lines
+
+
+def _self_times(node, kind, shard_id):
+    """Yield (self time, kind, type, description, shard id) of node of a profiled query or aggregation tree, and all
+    nodes under it.
+    """
+    children = node.get("children", [])
+    self_time = node["time_in_nanos"] - sum(child["time_in_nanos"] for child in children)
+    description = node.get("description", "")
+    if len(description) > MAX_DESCRIPTION_WIDTH:
+        description = description[: MAX_DESCRIPTION_WIDTH - 3] + "..."
+
+    yield max(self_time, 0), kind, node.get("type", ""), description, shard_id
+    for child in children:
+        yield from _self_times(child, kind, shard_id)
+
+
+def _millis(nanos):
+    return "%.3fms" % (nanos / 1e6)
+
+
+def _table(headers, rows):
+    """Render rows as a plain table with columns aligned, without pulling in the tabular formatter."""
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    return ["  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [headers] + rows]
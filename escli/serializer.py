@@ -0,0 +1,161 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import json
+import re
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+# json decoders of json_decoder option in esclirc. "auto" picks the fastest one installed.
+JSON_DECODERS = ("auto", "orjson", "json")
+
+WHITESPACE_REGEX = re.compile(r"\s*")
+
+
+def get_serializer(name="auto"):
+    """Get FastJSONSerializer decoding with json_decoder name, or the standard JSONSerializer if name is "json", or
+    "auto" and no fast decoder is installed.
+
+    :raises ImportError: if the decoder isn't installed
+    """
+    if name == "json":
+        return JSONSerializer()
+
+    try:
+        # optional dependency, several times faster than json module on large responses
+        import orjson
+    except ImportError:
+        if name == "auto":
+            return JSONSerializer()
+        raise
+
+    return FastJSONSerializer(orjson)
+
+
+class FastJSONSerializer(JSONSerializer):
+    """JSONSerializer decoding with orjson. Documents orjson rejects, such as ones with NaN, are decoded with json
+    module instead. Encoding is left to JSONSerializer, requests are small.
+    """
+
+    def __init__(self, orjson):
+        self.orjson = orjson
+
+    def loads(self, s):
+        try:
+            return self.orjson.loads(s)
+        except self.orjson.JSONDecodeError:
+            return super(FastJSONSerializer, self).loads(s)
+
+
+class LazyPage(dict):
+    """jdbc response decoded up to its "datarows", which are decoded one row at a time as they are iterated, so rows of
+    a large page are never all in memory at once.
+
+    Keys following "datarows" in the response are decoded once all rows are, or as soon as one of them is read, in
+    which case rows not iterated yet are decoded ahead and kept until they are.
+    """
+
+    def __init__(self, text):
+        super(LazyPage, self).__init__()
+        self.text = text
+        self.decoder = json.JSONDecoder()
+        # position of next row in text, None if all rows are decoded
+        self.row_pos = None
+        self.pending_rows = collections.deque()
+        self.decoded_rows = 0
+
+        try:
+            pos = self.skip(0)
+            if text[pos] != "{":
+                raise ValueError("Expecting object at %d" % pos)
+            self.decode_keys(pos + 1)
+        except (ValueError, IndexError) as e:
+            raise SerializationError(text, e)
+
+    def skip(self, pos):
+        return WHITESPACE_REGEX.match(self.text, pos).end()
+
+    def decode_keys(self, pos):
+        """Decode keys of the response object from pos, until its end or until "datarows"."""
+        text = self.text
+        while True:
+            pos = self.skip(pos)
+            if text[pos] == ",":
+                pos = self.skip(pos + 1)
+            if text[pos] == "}":
+                # nothing left to decode
+                self.text = None
+                return
+
+            key, pos = self.decoder.raw_decode(text, pos)
+            pos = self.skip(pos)
+            if text[pos] != ":":
+                raise ValueError("Expecting ':' at %d" % pos)
+            pos = self.skip(pos + 1)
+
+            if key == "datarows" and text[pos] == "[":
+                self.row_pos = pos + 1
+                dict.__setitem__(self, "datarows", self.iter_rows())
+                return
+
+            value, pos = self.decoder.raw_decode(text, pos)
+            dict.__setitem__(self, key, value)
+
+    def decode_row(self):
+        """Decode next row, or the keys following datarows after the last row.
+
+        :return: True if a row is added to pending_rows
+        """
+        text = self.text
+        pos = self.skip(self.row_pos)
+        if text[pos] == ",":
+            pos = self.skip(pos + 1)
+
+        if text[pos] == "]":
+            self.row_pos = None
+            self.decode_keys(pos + 1)
+            return False
+
+        row, self.row_pos = self.decoder.raw_decode(text, pos)
+        self.pending_rows.append(row)
+        self.decoded_rows += 1
+        return True
+
+    def iter_rows(self):
+        while self.pending_rows or (self.row_pos is not None and self.decode_row()):
+            yield self.pending_rows.popleft()
+
+    def decode_all(self):
+        while self.row_pos is not None:
+            self.decode_row()
+
+    def __missing__(self, key):
+        if self.row_pos is None:
+            raise KeyError(key)
+
+        self.decode_all()
+        return self[key]
+
+    def __contains__(self, key):
+        if not dict.__contains__(self, key):
+            self.decode_all()
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
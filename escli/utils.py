@@ -12,6 +12,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import re
 import sys
 
 from collections import namedtuple
@@ -19,3 +20,47 @@ from collections import namedtuple
 OutputSettings = namedtuple("OutputSettings", "table_format is_vertical max_width style_output missingval")
 
 OutputSettings.__new__.__defaults__ = (None, False, sys.maxsize, None, "null")
+
+# indices after FROM/JOIN in a statement, such as "FROM a, b" or "JOIN c"
+TABLES_REGEX = re.compile(r"\b(?:from|join)\s+([\w\-.*]+(?:\s*,\s*[\w\-.*]+)*)", re.IGNORECASE)
+
+
+def extract_tables(sql):
+    """Get names of indices that a SQL statement queries, in order of appearance."""
+    tables = []
+    for table_list in TABLES_REGEX.findall(sql):
+        tables.extend(table.strip() for table in table_list.split(","))
+
+    return tables
+
+
+# pieces of SQL text: string literals and quoted identifiers (unterminated ones run to the end), comments, semicolons,
+# and runs of other characters
+STATEMENT_TOKENS_REGEX = re.compile(
+    r"""'(?:[^'\\]|\\.|'')*'?|"(?:[^"\\]|\\.|"")*"?|`(?:[^`]|``)*`?|--[^\n]*|/\*.*?(?:\*/|\Z)|;|[^'"`;/-]+|.""",
+    re.DOTALL,
+)
+
+
+def split_statements(sql):
+    """Split SQL text into statements at semicolons, except the ones in string literals, quoted identifiers and
+    comments. Comments are left out of statements.
+
+    :return: list of statements, without semicolons and whitespace around them
+    """
+    statements = []
+    current = []
+    for token in STATEMENT_TOKENS_REGEX.findall(sql):
+        if token == ";":
+            statements.append("".join(current).strip())
+            current = []
+        elif token.startswith("--"):
+            continue
+        elif token.startswith("/*"):
+            # keeps words around the comment apart
+            current.append(" ")
+        else:
+            current.append(token)
+    statements.append("".join(current).strip())
+
+    return [statement for statement in statements if statement]
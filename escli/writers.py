@@ -0,0 +1,172 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import csv
+import itertools
+import json
+
+# number of bytes buffered before writing to the output file
+BUFFER_SIZE = 1024 * 1024
+
+# pyarrow type names of Open Distro SQL jdbc types. Others, such as text, date, ip, object and nested, are exported
+# as strings, with arrays and objects encoded in json.
+ARROW_TYPES = {
+    "boolean": "bool_",
+    "byte": "int8",
+    "short": "int16",
+    "integer": "int32",
+    "long": "int64",
+    "half_float": "float32",
+    "float": "float32",
+    "scaled_float": "float64",
+    "double": "float64",
+}
+
+
+class Writer:
+    """Base class of writers exporting jdbc result pages to a stream, page by page.
+
+    No text is built for the whole result set, a writer keeps at most one page in memory.
+    """
+
+    is_binary = False
+
+    def __init__(self, stream, schema):
+        """Initialize a Writer instance.
+
+        :param stream: file-like object to write to, binary if is_binary is True
+        :param schema: "schema" of the first jdbc page, a list of {"name", "type"}
+        """
+        self.stream = stream
+        self.schema = schema
+        self.fields = [field["name"] for field in schema]
+
+    def write_rows(self, rows):
+        raise NotImplementedError()
+
+    def close(self):
+        self.stream.flush()
+
+
+class NdjsonWriter(Writer):
+    """Write each row as a json object on its own line."""
+
+    def write_rows(self, rows):
+        if rows:
+            fields = self.fields
+            self.stream.write("\n".join(json.dumps(dict(zip(fields, row))) for row in rows) + "\n")
+
+
+class CsvWriter(Writer):
+    """Write rows as csv, with a header line of field names. Null is written as an empty field, booleans as
+    true/false, and arrays and objects as json, so that the values can be parsed back to their types.
+    """
+
+    def __init__(self, stream, schema):
+        super(CsvWriter, self).__init__(stream, schema)
+        self.csv_writer = csv.writer(stream, lineterminator="\n")
+        self.csv_writer.writerow(self.fields)
+
+    @staticmethod
+    def to_field(val):
+        if val is None:
+            return ""
+        if isinstance(val, bool):
+            return "true" if val else "false"
+        if isinstance(val, (list, dict)):
+            return json.dumps(val)
+        return val
+
+    def write_rows(self, rows):
+        to_field = self.to_field
+        self.csv_writer.writerows([to_field(val) for val in row] for row in rows)
+
+
+class ArrowWriter(Writer):
+    """Write rows as Apache Arrow IPC stream, one record batch per page. Requires pyarrow."""
+
+    is_binary = True
+
+    def __init__(self, stream, schema):
+        super(ArrowWriter, self).__init__(stream, schema)
+        # optional dependency, only needed by this writer
+        import pyarrow
+
+        self.pyarrow = pyarrow
+        self.arrow_schema = pyarrow.schema(
+            [(field["name"], getattr(pyarrow, ARROW_TYPES.get(field["type"], "string"))()) for field in schema]
+        )
+        self.batch_writer = self.open_batch_writer()
+
+    def open_batch_writer(self):
+        return self.pyarrow.ipc.new_stream(self.stream, self.arrow_schema)
+
+    def to_batch(self, rows):
+        columns = []
+        for i, field in enumerate(self.arrow_schema):
+            column = [row[i] for row in rows]
+            if field.type == self.pyarrow.string():
+                column = [val if val is None or isinstance(val, str) else json.dumps(val) for val in column]
+            columns.append(self.pyarrow.array(column, type=field.type))
+
+        return self.pyarrow.RecordBatch.from_arrays(columns, schema=self.arrow_schema)
+
+    def write_rows(self, rows):
+        if rows:
+            self.batch_writer.write_batch(self.to_batch(rows))
+
+    def close(self):
+        self.batch_writer.close()
+        super(ArrowWriter, self).close()
+
+
+class ParquetWriter(ArrowWriter):
+    """Write rows as a Parquet file, one row group per page. Requires pyarrow."""
+
+    def open_batch_writer(self):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(self.stream, self.arrow_schema)
+
+    def write_rows(self, rows):
+        if rows:
+            self.batch_writer.write_table(self.pyarrow.Table.from_batches([self.to_batch(rows)]))
+
+
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter, "arrow": ArrowWriter, "parquet": ParquetWriter}
+
+
+def write_pages(pages, export_format, stream):
+    """Export jdbc result pages to stream as they arrive.
+
+    :param pages: iterable of raw jdbc pages, the first page carries schema
+    :param export_format: ndjson/csv/arrow/parquet
+    :param stream: file-like object, binary for arrow and parquet
+    :return: number of rows written
+    """
+    pages = iter(pages)
+    first_page = next(pages, None)
+    if not first_page:
+        return 0
+
+    writer = WRITERS[export_format](stream, first_page["schema"])
+    count = 0
+    try:
+        for page in itertools.chain([first_page], pages):
+            writer.write_rows(page["datarows"])
+            count += len(page["datarows"])
+    finally:
+        writer.close()
+
+    return count
@@ -53,6 +53,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     install_requires=install_requirements,
+    extras_require={"arrow": ["pyarrow"], "async": ["aiohttp"], "fast": ["orjson"]},
     entry_points={"console_scripts": ["escli=escli.main:cli"]},
     classifiers=[
         "Intended Audience :: Developers",
@@ -0,0 +1,50 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import os
+import pytest
+
+from prompt_toolkit.document import Document
+
+from synthetic import index_names
+from escli.escompleter import ESCompleter
+
+INDEX_COUNTS = (1000, 10000, 100000)
+
+
+@pytest.fixture(scope="module")
+def literals():
+    from escli.esliterals import __file__ as package_root
+
+    with open(os.path.join(os.path.dirname(package_root), "esliterals.json")) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("indices", INDEX_COUNTS)
+def test_build_completer(benchmark, literals, indices):
+    benchmark.group = "build_completer"
+    names = index_names(indices)
+
+    benchmark(ESCompleter, literals["keywords"], literals["functions"], names)
+
+
+@pytest.mark.parametrize("text", ["SELECT * FROM logs-app-1", "SELECT * FROM ", "SEL"])
+@pytest.mark.parametrize("indices", INDEX_COUNTS)
+def test_get_completions(benchmark, literals, indices, text):
+    benchmark.group = "get_completions-%r" % text
+    completer = ESCompleter(literals["keywords"], literals["functions"], index_names(indices))
+    document = Document(text)
+
+    benchmark(lambda: list(completer.get_completions(document, None)))
@@ -0,0 +1,88 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import pytest
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from synthetic import index_names
+from escli.cache import MetadataCache
+from escli.esconnection import ESConnection
+
+INDEX_COUNT = 1000
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer the requests sent by ESConnection.set_connection, as an Open Distro cluster would."""
+
+    protocol_version = "HTTP/1.1"
+    responses = {
+        "/_cat/plugins": ("text/plain", "name component version\nnode-1 opendistro_sql 1.0.0.0\n"),
+        "/": ("application/json", json.dumps({"version": {"number": "7.0.1"}})),
+        "/_alias": ("application/json", json.dumps({index: {"aliases": {}} for index in index_names(INDEX_COUNT)})),
+    }
+
+    def do_GET(self):
+        content_type, body = self.responses.get(self.path.partition("?")[0], ("application/json", "{}"))
+        body = body.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+
+
+def connect(endpoint, metadata_cache=None):
+    es_executor = ESConnection(endpoint, metadata_cache=metadata_cache)
+    es_executor.set_connection()
+    return es_executor
+
+
+def test_set_connection(benchmark, endpoint):
+    benchmark.group = "set_connection"
+    es_executor = benchmark(connect, endpoint)
+
+    assert es_executor.es_version == "7.0.1"
+    assert len(es_executor.indices_list) == INDEX_COUNT
+
+
+def test_set_connection_cached(benchmark, endpoint, tmpdir):
+    benchmark.group = "set_connection"
+    metadata_cache = MetadataCache(ttl=3600, cache_dir=str(tmpdir))
+    connect(endpoint, metadata_cache)
+
+    es_executor = benchmark(connect, endpoint, metadata_cache)
+
+    assert es_executor.is_metadata_cached
+    assert len(es_executor.indices_list) == INDEX_COUNT
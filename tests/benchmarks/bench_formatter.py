@@ -0,0 +1,54 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import pytest
+
+from synthetic import jdbc_response, nested_array_response, rounds
+from escli.formatter import Formatter
+from escli.utils import OutputSettings
+
+SCHEMAS = {"narrow": 3, "wide": 30}
+
+
+def consume(lines):
+    collections.deque(lines, maxlen=0)
+
+
+@pytest.mark.parametrize("table_format", ["psql", "vertical"])
+@pytest.mark.parametrize("schema", sorted(SCHEMAS))
+def test_format_output(benchmark, rows, schema, table_format):
+    benchmark.group = "format_output-%s-%s" % (table_format, schema)
+    data = jdbc_response(rows, SCHEMAS[schema])
+    formatter = Formatter(OutputSettings(table_format=table_format))
+
+    benchmark.pedantic(lambda: consume(formatter.format_output(data)), rounds=rounds(rows))
+
+
+def test_format_arrays(benchmark, rows):
+    benchmark.group = "format_arrays"
+    data = nested_array_response(rows)
+    formatter = Formatter(OutputSettings(table_format="psql"))
+    format_arrays = formatter.output_kwargs["preprocessors"][-1]
+    headers = [field["name"] for field in data["schema"]]
+
+    benchmark.pedantic(lambda: consume(format_arrays(data["datarows"], headers)[0]), rounds=rounds(rows))
+
+
+def test_format_output_nested_arrays(benchmark, rows):
+    benchmark.group = "format_output-psql-nested"
+    data = nested_array_response(rows)
+    formatter = Formatter(OutputSettings(table_format="psql"))
+
+    benchmark.pedantic(lambda: consume(formatter.format_output(data)), rounds=rounds(rows))
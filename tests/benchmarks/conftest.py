@@ -0,0 +1,30 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from synthetic import ROW_COUNTS
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--max-rows",
+        type=int,
+        default=max(ROW_COUNTS),
+        help="Skip benchmarks of responses with more rows than this, for a quick run",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "rows" in metafunc.fixturenames:
+        max_rows = metafunc.config.getoption("max_rows")
+        metafunc.parametrize("rows", [rows for rows in ROW_COUNTS if rows <= max_rows])
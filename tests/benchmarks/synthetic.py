@@ -0,0 +1,71 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import itertools
+
+# number of rows of synthetic responses
+ROW_COUNTS = (1000, 100000, 1000000)
+# number of distinct rows generated, larger responses repeat them so they fit in memory
+DISTINCT_ROWS = 1000
+
+TYPES = ("keyword", "long", "double", "date", "text")
+
+
+def rounds(rows):
+    """Number of rounds for a response of rows, fewer for larger ones to keep the suite under a few minutes."""
+    return max(1, min(20, 100000 // rows))
+
+
+def make_schema(columns):
+    return [{"name": "%s_%d" % (TYPES[i % len(TYPES)], i), "type": TYPES[i % len(TYPES)]} for i in range(columns)]
+
+
+def make_value(field_type, i):
+    if i % 50 == 0:
+        return None
+    if field_type == "keyword":
+        return "user_%d" % (i % 997)
+    if field_type == "long":
+        return i * 7919
+    if field_type == "double":
+        return i / 7.0
+    if field_type == "date":
+        return "2019-07-%02d 10:%02d:%02d" % (i % 28 + 1, i % 60, i % 60)
+    return "lorem ipsum dolor sit amet " * (i % 4 + 1)
+
+
+def jdbc_response(rows, columns):
+    """Build a jdbc response of Open Distro SQL, as returned by ESConnection.execute_query."""
+    schema = make_schema(columns)
+    distinct = [[make_value(field["type"], i + j) for j, field in enumerate(schema)] for i in range(DISTINCT_ROWS)]
+    datarows = list(itertools.islice(itertools.cycle(distinct), rows))
+
+    return {"schema": schema, "datarows": datarows, "total": rows, "size": rows, "status": 200}
+
+
+def nested_array_response(rows):
+    """Build a jdbc response whose fields are arrays, nested up to three levels."""
+    schema = [{"name": "tags", "type": "text"}, {"name": "points", "type": "nested"}]
+    distinct = [
+        [["tag_%d" % (i % 13), "tag_%d" % (i % 17), None], [[i, [i + 1, i + 2]], [], [None, [i * 3]]]]
+        for i in range(DISTINCT_ROWS)
+    ]
+    datarows = list(itertools.islice(itertools.cycle(distinct), rows))
+
+    return {"schema": schema, "datarows": datarows, "total": rows, "size": rows, "status": 200}
+
+
+def index_names(count):
+    """Index names as found on logging clusters, such as "logs-app-3-2019.07.21"."""
+    return ["logs-app-%d-2019.%02d.%02d" % (i // 365, i % 365 // 28 + 1, i % 28 + 1) for i in range(count)]
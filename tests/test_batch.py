@@ -0,0 +1,124 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import mock
+import time
+
+from elasticsearch.exceptions import NotFoundError
+from escli.batch import read_statements, run_batch, run_batch_async
+from escli.esasyncconnection import start_event_loop
+from escli.utils import split_statements
+
+
+class TestBatch:
+    def test_read_statements(self, tmpdir):
+        batch_file = tmpdir.join("queries.sql")
+        batch_file.write("select * from a;\n\nselect *\nfrom b;\n")
+
+        assert read_statements(str(batch_file)) == ["select * from a", "select *\nfrom b"]
+
+    def test_read_statements_with_literals_and_comments(self, tmpdir):
+        batch_file = tmpdir.join("queries.sql")
+        batch_file.write(
+            "-- check a;b\n"
+            "select * from a where b = 'x;y' and c = 'it''s;';\n"
+            'select "d;e" from b /* ; */ where f = 1;\n'
+            "/* only a comment; */\n"
+            "select 'g\\';' from c -- last"
+        )
+
+        assert read_statements(str(batch_file)) == [
+            "select * from a where b = 'x;y' and c = 'it''s;'",
+            'select "d;e" from b   where f = 1',
+            "select 'g\\';' from c",
+        ]
+
+    def test_split_unterminated(self):
+        assert split_statements("select 1; select 'a;b") == ["select 1", "select 'a;b"]
+        assert split_statements("select 1 /* a;b") == ["select 1"]
+
+    def test_run_batch_keeps_order(self):
+        es_executor = mock.Mock()
+
+        # first query is the slowest one
+        def execute_query(query, **_):
+            time.sleep(0.1 if query == "select 1" else 0)
+            return query.upper()
+
+        es_executor.execute_query.side_effect = execute_query
+        results = list(run_batch(es_executor, ["select 1", "select 2", "select 3"], concurrency=3))
+
+        assert [(query, output) for query, output, _, _ in results] == [
+            ("select 1", "SELECT 1"),
+            ("select 2", "SELECT 2"),
+            ("select 3", "SELECT 3"),
+        ]
+        assert results[0][2] >= 0.1
+        es_executor.execute_query.assert_called_with(
+            "select 3", output_format="jdbc", explain=False, use_console=False, use_cache=True, profile=results[2][3]
+        )
+
+    def test_run_batch_failure(self):
+        es_executor = mock.Mock()
+        es_executor.execute_query.side_effect = [NotFoundError(404, "index_not_found_exception"), "Q2"]
+
+        with mock.patch("escli.batch.click.secho") as mock_secho:
+            results = list(run_batch(es_executor, ["select * from a", "select * from b"], concurrency=1))
+
+        assert [(query, output) for query, output, _, _ in results] == [
+            ("select * from a", None),
+            ("select * from b", "Q2"),
+        ]
+        mock_secho.assert_called_once()
+
+    def test_run_batch_writes_run_alone(self):
+        es_executor = mock.Mock()
+        events = []
+
+        def execute_query(query, **_):
+            events.append("start " + query)
+            time.sleep(0.05 if query == "select 1" else 0)
+            events.append("end " + query)
+            return query
+
+        es_executor.execute_query.side_effect = execute_query
+        queries = ["select 1", "select 2", "delete from a", "select 3"]
+        results = list(run_batch(es_executor, queries, concurrency=3))
+
+        assert [query for query, _, _, _ in results] == queries
+        delete = events.index("start delete from a")
+        assert set(events[:delete]) == {"start select 1", "end select 1", "start select 2", "end select 2"}
+        assert events[delete + 1 :] == ["end delete from a", "start select 3", "end select 3"]
+
+    def test_run_batch_async_keeps_order(self):
+        in_flight = []
+        max_in_flight = []
+
+        class Executor:
+            async def execute_query(self, query, **_):
+                in_flight.append(query)
+                max_in_flight.append(len(in_flight))
+                await asyncio.sleep(0.1 if query == "select 1" else 0)
+                in_flight.remove(query)
+                return query.upper()
+
+        loop = start_event_loop()
+        queries = ["select 1", "select 2", "select 3", "select 4"]
+        results = list(run_batch_async(Executor(), queries, loop, concurrency=2))
+        loop.call_soon_threadsafe(loop.stop)
+
+        assert [(query, output) for query, output, _, _ in results] == [(query, query.upper()) for query in queries]
+        assert results[0][2] >= 0.1
+        assert max(max_in_flight) == 2
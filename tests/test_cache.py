@@ -0,0 +1,128 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import mock
+import os
+
+from escli.cache import DiskResultCache, LRUCache, MemoryResultCache, MetadataCache, ResultCache
+
+ENDPOINT = "http://localhost:9200"
+
+
+class TestMetadataCache:
+    def test_get_and_set(self, tmpdir):
+        cache = MetadataCache(ttl=60, cache_dir=str(tmpdir))
+        assert cache.get(ENDPOINT) is None
+
+        cache.set(ENDPOINT, "opendistro_sql", "7.0.1", ["a", "b"])
+        metadata = cache.get(ENDPOINT)
+
+        assert metadata["plugins"] == "opendistro_sql"
+        assert metadata["es_version"] == "7.0.1"
+        assert metadata["indices"] == ["a", "b"]
+        assert cache.get("http://other:9200") is None
+
+    def test_expired(self, tmpdir):
+        cache = MetadataCache(ttl=60, cache_dir=str(tmpdir))
+        cache.set(ENDPOINT, "opendistro_sql", "7.0.1", [])
+
+        with mock.patch("escli.cache.time.time", return_value=2**40):
+            assert cache.get(ENDPOINT) is None
+
+    def test_disabled(self, tmpdir):
+        cache = MetadataCache(ttl=0, cache_dir=str(tmpdir))
+        cache.set(ENDPOINT, "opendistro_sql", "7.0.1", [])
+
+        assert cache.get(ENDPOINT) is None
+        assert tmpdir.listdir() == []
+
+    def test_invalidate(self, tmpdir):
+        cache = MetadataCache(ttl=60, cache_dir=str(tmpdir))
+        cache.set(ENDPOINT, "opendistro_sql", "7.0.1", [])
+        cache.set("http://other:9200", "opendistro_sql", "7.0.1", [])
+
+        cache.invalidate(ENDPOINT)
+        assert cache.get(ENDPOINT) is None
+        assert cache.get("http://other:9200") is not None
+
+        cache.invalidate()
+        assert tmpdir.listdir() == []
+
+
+class TestLRUCache:
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(max_size=5)
+        cache.set("a", "aa")
+        cache.set("b", "bb")
+        cache.get("a")
+        cache.set("c", "cc")
+
+        assert "b" not in cache
+        assert cache.get("a") == "aa"
+        assert cache.get("c") == "cc"
+        assert cache.size == 4
+
+    def test_keep_entry_larger_than_max_size(self):
+        cache = LRUCache(max_size=1)
+        cache.set("a", "aaa")
+
+        assert cache.get("a") == "aaa"
+
+
+class TestResultCache:
+    def test_key(self):
+        key = ResultCache.key(ENDPOINT, "select *  from a\nwhere b = 'x  y';", "jdbc")
+
+        assert key == ResultCache.key(ENDPOINT, " select * from a where b = 'x  y'", "jdbc")
+        assert key != ResultCache.key(ENDPOINT, "select * from a where b = 'x y'", "jdbc")
+        assert key != ResultCache.key(ENDPOINT, "select * from a where b = 'x  y'", "csv")
+        assert key != ResultCache.key(ENDPOINT, "select * from a where b = 'x  y'", "jdbc", explain=True)
+        assert key != ResultCache.key("http://other:9200", "select * from a where b = 'x  y'", "jdbc")
+        assert key != ResultCache.key(ENDPOINT, "select * from a where b = 'x  y'", "jdbc", username="other")
+
+    def test_memory(self):
+        cache = MemoryResultCache(ttl=60, max_size=100)
+        cache.set("a", {"datarows": [[1]]})
+
+        assert cache.get("a") == {"datarows": [[1]]}
+        assert cache.get("b") is None
+        with mock.patch("escli.cache.time.time", return_value=2**40):
+            assert cache.get("a") is None
+
+    def test_memory_evict(self):
+        cache = MemoryResultCache(ttl=60, max_size=10)
+        cache.set("a", "a" * 6)
+        cache.set("b", "b" * 6)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == "b" * 6
+
+    def test_disk(self, tmpdir):
+        cache = DiskResultCache(ttl=60, max_size=100, cache_dir=str(tmpdir))
+        cache.set("a", {"datarows": [[1]]})
+
+        assert DiskResultCache(ttl=60, max_size=100, cache_dir=str(tmpdir)).get("a") == {"datarows": [[1]]}
+        assert cache.get("b") is None
+        with mock.patch("escli.cache.time.time", return_value=2**40):
+            assert cache.get("a") is None
+        assert tmpdir.listdir() == []
+
+    def test_disk_evict_oldest(self, tmpdir):
+        cache = DiskResultCache(ttl=60, max_size=20, cache_dir=str(tmpdir))
+        cache.set("a", "a" * 10)
+        os.utime(cache._path("a"), (0, 0))
+        cache.set("b", "b" * 10)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == "b" * 10
@@ -0,0 +1,147 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import json
+import mock
+import pytest
+import threading
+
+from elasticsearch.exceptions import ConnectionError
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from escli.cache import MemoryResultCache
+from escli.esasyncconnection import AsyncESConnection
+from escli.esconnection import RetryPolicy
+
+aiohttp = pytest.importorskip("aiohttp")
+
+RESPONSES = {
+    "/_cat/plugins": ("text/plain", "node opendistro_sql 1.0.0.0"),
+    "/": ("application/json", json.dumps({"version": {"number": "7.0.1"}})),
+    "/_alias": ("application/json", json.dumps({"accounts": {}, "logs": {}})),
+    "/_opendistro/_sql/": ("application/json", json.dumps({"schema": [], "datarows": [[1], [2]], "total": 2})),
+}
+
+
+@pytest.fixture()
+def server():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self):
+            path = self.path.split("?")[0]
+            length = int(self.headers.get("Content-Length") or 0)
+            requests.append((self.command, path, self.headers.get("Authorization"), self.rfile.read(length)))
+
+            if path == "/_opendistro/_sql/_explain":
+                status, content_type, body = 400, "application/json", json.dumps({"error": "bad query"})
+            else:
+                status, (content_type, body) = 200, RESPONSES[path]
+            body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *_):
+            pass
+
+    server = HTTPServer(("localhost", 0), Handler)
+    server.requests = requests
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class TestAsyncESConnection:
+    def test_set_connection(self, server):
+        # nothing listens on port 1
+        endpoint = "http://localhost:1, http://localhost:%d" % server.server_address[1]
+        test_executor = AsyncESConnection(endpoint, http_auth=("user", "pass"))
+
+        async def connect():
+            try:
+                return await test_executor.set_connection()
+            finally:
+                await test_executor.close()
+
+        assert run(connect()) is True
+        assert test_executor.es_version == "7.0.1"
+        assert test_executor.indices_list == ["accounts", "logs"]
+        assert {path for _, path, _, _ in server.requests} == {"/_cat/plugins", "/", "/_alias"}
+        assert all(auth.startswith("Basic ") for _, _, auth, _ in server.requests)
+
+    def test_execute_query(self, server):
+        test_executor = AsyncESConnection("http://localhost:%d" % server.server_address[1])
+        test_executor.result_cache = MemoryResultCache(ttl=60, max_size=1024)
+
+        async def execute():
+            await test_executor.open_session()
+            try:
+                data = await test_executor.execute_query("select a from t;")
+                cached = await test_executor.execute_query("select a from t")
+                with mock.patch("escli.esasyncconnection.click.secho") as mock_secho:
+                    explained = await test_executor.execute_query("select a from", explain=True)
+                return data, cached, explained, mock_secho
+            finally:
+                await test_executor.close()
+
+        data, cached, explained, mock_secho = run(execute())
+
+        assert data["datarows"] == [[1], [2]]
+        assert cached == data
+        assert explained is None
+        mock_secho.assert_called_with(message="bad query", fg="red")
+        # second query is answered by result cache
+        assert [(method, path) for method, path, _, _ in server.requests] == [
+            ("POST", "/_opendistro/_sql/"),
+            ("POST", "/_opendistro/_sql/_explain"),
+        ]
+        assert json.loads(server.requests[0][3]) == {"query": "select a from t"}
+
+    def test_retry_read_only_query(self):
+        test_executor = AsyncESConnection("http://localhost:1", retry_policy=RetryPolicy(2, 0.0, 0.0))
+        lost = ConnectionError("N/A", "lost", None)
+        data = {"schema": [], "datarows": [], "total": 0, "size": 0}
+
+        with mock.patch.object(
+            test_executor, "perform_request", side_effect=[lost, data, lost, data]
+        ) as mock_perform_request, mock.patch("escli.esasyncconnection.click.secho"):
+            assert run(test_executor.execute_query("select * from t")) == data
+            assert mock_perform_request.call_count == 2
+            # statements changing data may have run already
+            assert run(test_executor.execute_query("delete from t", use_console=False)) is None
+            assert mock_perform_request.call_count == 3
+
+    def test_connection_failed(self):
+        test_executor = AsyncESConnection("http://localhost:1")
+
+        async def connect():
+            try:
+                return await test_executor.set_connection()
+            finally:
+                await test_executor.close()
+
+        with mock.patch("escli.esasyncconnection.click.secho") as mock_secho:
+            assert run(connect()) is False
+
+        mock_secho.assert_called_with(message="Can not connect to endpoint http://localhost:1", fg="red")
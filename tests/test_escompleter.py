@@ -0,0 +1,95 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import mock
+import pytest
+from prompt_toolkit.document import Document
+
+from escli.escompleter import ESCompleter, PrefixIndex, extract_tables
+
+KEYWORDS = ["SELECT", "FROM", "WHERE", "SHOW", "TABLES", "LIKE"]
+FUNCTIONS = ["SUM", "SQRT"]
+INDICES = ["accounts", "logs-2019.01", "logs-2019.02", "Sales"]
+
+
+@pytest.fixture()
+def completer():
+    return ESCompleter(KEYWORDS, FUNCTIONS, INDICES)
+
+
+def complete(completer, text, cursor_position=None):
+    document = Document(text, cursor_position)
+    return [completion.text for completion in completer.get_completions(document, None)]
+
+
+class TestESCompleter:
+    def test_prefix_index(self):
+        index = PrefixIndex(INDICES)
+
+        assert index.find("LOGS") == ["logs-2019.01", "logs-2019.02"]
+        assert index.find("s") == ["Sales"]
+        assert index.find("logs", limit=1) == ["logs-2019.01"]
+        assert index.find("missing") == []
+
+    @pytest.mark.parametrize(
+        "text,expected",
+        [
+            ("s", ["SELECT", "SHOW", "SQRT", "SUM"]),
+            ("select * from ", INDICES),
+            ("select * from logs-2019.", ["logs-2019.01", "logs-2019.02"]),
+            ("select * FROM accounts, sa", ["Sales"]),
+            ("select * from accounts w", ["WHERE"]),
+            ("select a, s", ["SELECT", "SHOW", "SQRT", "SUM"]),
+            ("show tables like a", ["accounts"]),
+        ],
+    )
+    def test_completions(self, completer, text, expected):
+        assert complete(completer, text) == expected
+
+    def test_start_position(self, completer):
+        completions = list(completer.get_completions(Document("select * from logs-20"), None))
+
+        assert completions[0].start_position == -len("logs-20")
+        assert completions[0].display_meta_text == "index"
+
+    def test_large_index_list(self):
+        completer = ESCompleter(KEYWORDS, FUNCTIONS, ["index-%05d" % i for i in range(50000)])
+
+        assert len(complete(completer, "select * from index-")) == 100
+        assert complete(completer, "select * from index-4999") == ["index-4999%d" % i for i in range(10)]
+
+    def test_extract_tables(self):
+        assert extract_tables("select a from accounts, logs-* where b = 1") == ["accounts", "logs-*"]
+        assert extract_tables("SELECT * FROM a JOIN b ON a.x = b.x") == ["a", "b"]
+        assert extract_tables("select 1") == []
+
+    def test_field_completions(self):
+        get_fields = mock.Mock(return_value=["age", "name", "name.keyword"])
+        completer = ESCompleter(KEYWORDS, FUNCTIONS, INDICES, get_fields)
+
+        # mapping is fetched in background on first use
+        assert complete(completer, "select na from accounts", cursor_position=9) == []
+        completer.fetch_executor.shutdown(wait=True)
+
+        assert complete(completer, "select na from accounts", cursor_position=9) == ["name", "name.keyword"]
+        assert complete(completer, "select * from accounts where s") == ["SELECT", "SHOW", "SQRT", "SUM"]
+        get_fields.assert_called_once_with("accounts")
+
+    def test_field_completions_skip_unknown_index(self):
+        get_fields = mock.Mock()
+        completer = ESCompleter(KEYWORDS, FUNCTIONS, INDICES, get_fields)
+
+        complete(completer, "select * from acc")
+
+        get_fields.assert_not_called()
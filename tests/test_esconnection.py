@@ -12,15 +12,36 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import io
 import pytest
 import mock
+import socket
+import threading
+import time
 from textwrap import dedent
 
 from elasticsearch.exceptions import ConnectionError
 from elasticsearch import Elasticsearch, RequestsHttpConnection
+from elasticsearch.connection_pool import RoundRobinSelector
+from elasticsearch.serializer import Deserializer, JSONSerializer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 
 from utils import estest, load_data, run, TEST_INDEX_NAME
-from escli.esconnection import ESConnection
+from escli.cache import MemoryResultCache, MetadataCache
+from escli.config import get_config
+from escli.profiler import QueryProfile
+from escli.esconnection import (
+    ESConnection,
+    CancellableHttpConnection,
+    DEFAULT_FETCH_SIZE,
+    LeastLatencySelector,
+    PageSizer,
+    ProfilingDeserializer,
+    QueryCancelled,
+    QueryFailed,
+    RetryPolicy,
+    get_transport_settings,
+)
 
 INVALID_ENDPOINT = "http://invalid:9200"
 OPEN_DISTRO_ENDPOINT = "https://opedistro:9200"
@@ -99,6 +120,163 @@ class TestExecutor:
                 message="Connection Failed. Check your ES is running and then come back", fg="red"
             )
 
+    def test_retry_read_only_query(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT, retry_policy=RetryPolicy(retries=2, backoff=0))
+        data = {"schema": [], "total": 0, "size": 0, "datarows": []}
+
+        with mock.patch.object(test_executor, "client") as mock_client, mock.patch.object(
+            test_executor, "reconnect"
+        ) as mock_reconnect, mock.patch("escli.esconnection.click.secho"):
+            mock_client.transport.perform_request.side_effect = [ConnectionError("N/A"), ConnectionError("N/A"), data]
+            assert test_executor.execute_query("select * from t", use_console=False) == data
+            assert mock_reconnect.call_count == 2
+
+            # retries are used up
+            mock_client.transport.perform_request.side_effect = ConnectionError("N/A")
+            assert test_executor.execute_query("select * from t", use_console=False) is None
+            assert mock_client.transport.perform_request.call_count == 6
+
+            # statements changing data are not sent twice
+            assert test_executor.execute_query("delete from t", use_console=False) is None
+            assert mock_client.transport.perform_request.call_count == 7
+
+    def test_profile(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        profile = QueryProfile("select * from t")
+        response = '{"schema": [], "total": 2, "size": 2, "datarows": [["x"], ["y"]]}'
+
+        def perform_request(**_):
+            return test_executor.client.transport.deserializer.loads(response, "application/json")
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.deserializer = ProfilingDeserializer(
+                Deserializer({"application/json": JSONSerializer()}), test_executor.request_stats
+            )
+            mock_client.transport.perform_request.side_effect = perform_request
+            test_executor.execute_query("select * from t", profile=profile)
+
+        assert list(profile.timings) == ["network", "decode"]
+        assert profile.timings["decode"] > 0
+        assert profile.bytes == len(response)
+        assert profile.rows == 2
+
+    def test_profile_search(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        dsl = {"from": 0, "size": 200, "query": {"term": {"a": "x"}}}
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.perform_request.side_effect = [dsl, {"took": 1}]
+            assert test_executor.profile_search("select * from a, b where a = 'x';") == {"took": 1}
+
+        mock_client.transport.perform_request.assert_called_with(
+            url="/a,b/_search", method="POST", body=dict(dsl, profile=True)
+        )
+
+    def test_profile_search_join(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+
+        with mock.patch.object(test_executor, "client") as mock_client, mock.patch(
+            "escli.esconnection.click.secho"
+        ) as mock_secho:
+            mock_client.transport.perform_request.return_value = {"left": {}, "right": {}}
+            assert test_executor.profile_search("select * from a join b on a.x = b.x") is None
+
+        assert mock_client.transport.perform_request.call_count == 1
+        mock_secho.assert_called_with(
+            message="Only queries explained to a single search request can be profiled", fg="red"
+        )
+
+    def test_execute_query_slices(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        dsl = {"from": 0, "size": 200, "_source": {"includes": ["a", "b.c"], "excludes": []}}
+        schema = [{"name": "a", "type": "long"}, {"name": "x", "type": "long"}]
+        requests = []
+
+        def perform_request(url, method, params=None, body=None):
+            requests.append((url, method, body))
+            if url == "/_opendistro/_sql/_explain":
+                return dsl
+            if url == "/_opendistro/_sql/":
+                return {"schema": schema, "total": 3, "datarows": [[1, 2]], "cursor": "c"}
+            if url == "/t/_search":
+                slice_id = body["slice"]["id"]
+                hits = [{"_source": {"a": slice_id, "b": {"c": i}}} for i in range(slice_id + 1)]
+                return {"_scroll_id": "s%d" % slice_id, "hits": {"hits": hits}}
+            if url == "/_search/scroll" and method == "POST":
+                return {"_scroll_id": body["scroll_id"], "hits": {"hits": []}}
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.perform_request.side_effect = perform_request
+            pages = list(test_executor.execute_query_slices("select a, b.c as x from t", 2, 100))
+
+        assert pages[0] == {"schema": schema, "datarows": []}
+        assert sorted(row for page in pages[1:] for row in page["datarows"]) == [[0, 0], [1, 0], [1, 1]]
+        assert (
+            "/t/_search",
+            "POST",
+            {"_source": dsl["_source"], "size": 100, "slice": {"id": 1, "max": 2}},
+        ) in requests
+        # cursor of schema page and both scrolls are released
+        assert ("/_opendistro/_sql/close", "POST", {"cursor": "c"}) in requests
+        assert ("/_search/scroll", "DELETE", {"scroll_id": ["s0"]}) in requests
+        assert ("/_search/scroll", "DELETE", {"scroll_id": ["s1"]}) in requests
+
+    def test_execute_query_slices_with_limit(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+
+        with mock.patch.object(test_executor, "client") as mock_client, mock.patch("escli.esconnection.click.secho"):
+            mock_client.transport.perform_request.return_value = {"from": 0, "size": 10}
+            assert test_executor.execute_query_slices("select * from t limit 10", 2, 100) is None
+
+        assert mock_client.transport.perform_request.call_count == 1
+
+    def test_lazy_pages(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        responses = [
+            '{"schema": [{"name": "a", "type": "long"}], "total": 3, "datarows": [[1], [2]], "cursor": "c1"}',
+            '{"datarows": [[3]], "size": 1}',
+        ]
+
+        def perform_request(**_):
+            return test_executor.client.transport.deserializer.loads(responses.pop(0), "application/json")
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.deserializer = ProfilingDeserializer(
+                Deserializer({"application/json": JSONSerializer()}), test_executor.request_stats
+            )
+            mock_client.transport.perform_request.side_effect = perform_request
+            profile = QueryProfile("select a from t")
+            pages = test_executor.execute_query_pages("select a from t", fetch_size=2, profile=profile, lazy=True)
+
+            rows = [row for page in pages for row in page["datarows"]]
+
+        assert rows == [[1], [2], [3]]
+        assert profile.rows == 3
+        # cursor following rows is decoded once they are consumed
+        mock_client.transport.perform_request.assert_called_with(
+            url="/_opendistro/_sql/", method="POST", params={"format": "jdbc"}, body={"cursor": "c1"}
+        )
+        assert not test_executor.request_stats.lazy_rows
+
+    def test_reconnect(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        test_executor.es_version = "7.0.1"
+
+        with mock.patch.object(test_executor, "build_client") as mock_build_client, mock.patch.object(
+            test_executor, "set_connection"
+        ) as mock_set_connection:
+            mock_build_client.return_value.info.return_value = {"version": {"number": "7.0.1"}}
+            test_executor.reconnect()
+
+            assert test_executor.client is mock_build_client.return_value
+            mock_set_connection.assert_not_called()
+
+            # cluster is upgraded, fetch its metadata again
+            mock_build_client.return_value.info.return_value = {"version": {"number": "7.1.0"}}
+            test_executor.reconnect()
+
+            mock_set_connection.assert_called_with(is_reconnect=True)
+
     def test_reconnection_exception(self):
         test_executor = ESConnection(endpoint=INVALID_ENDPOINT)
 
@@ -128,9 +306,128 @@ class TestExecutor:
             od_test_executor.get_open_distro_client()
 
             mock_es.assert_called_with(
-                [OPEN_DISTRO_ENDPOINT], http_auth=AUTH, verify_certs=False, ssl_context=od_test_executor.ssl_context
+                [OPEN_DISTRO_ENDPOINT],
+                http_auth=AUTH,
+                verify_certs=False,
+                ssl_context=od_test_executor.ssl_context,
+                connection_class=CancellableHttpConnection,
+                cancel_event=od_test_executor.cancel_event,
             )
 
+    def test_get_transport_settings(self, default_config_location):
+        config = get_config(default_config_location)
+        config["main"]["timeout"] = "30"
+
+        settings = get_transport_settings(config, http_compress=True, max_connections=None, max_retries=5, sniff=True)
+
+        assert isinstance(settings.pop("serializers")["application/json"], JSONSerializer)
+        assert settings == {
+            "http_compress": True,
+            "timeout": 30.0,
+            "max_retries": 5,
+            "selector_class": RoundRobinSelector,
+            "sniff_on_start": True,
+            "sniff_on_connection_fail": True,
+        }
+
+    def test_least_latency_selector(self):
+        connections = [mock.Mock(latency=0.5), mock.Mock(latency=0.1), mock.Mock(latency=0.3)]
+        selector = LeastLatencySelector({})
+
+        assert selector.select(connections) is connections[1]
+        connections.append(mock.Mock(latency=None))
+        assert selector.select(connections) is connections[3]
+
+    def test_failover(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b'{"version": {"number": "7.0.1"}}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        server = HTTPServer(("localhost", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        # nothing listens on port 1
+        endpoint = "http://localhost:1, http://localhost:%d" % server.server_address[1]
+        test_executor = ESConnection(endpoint=endpoint, transport_settings={"selector_class": LeastLatencySelector})
+
+        with mock.patch.object(ESConnection, "is_sql_plugin_installed", return_value=True), mock.patch.object(
+            ESConnection, "get_indices"
+        ):
+            test_executor.set_connection()
+            versions = [test_executor.client.info()["version"]["number"] for _ in range(3)]
+        server.shutdown()
+
+        assert test_executor.hosts == ["http://localhost:1", "http://localhost:%d" % server.server_address[1]]
+        assert test_executor.es_version == "7.0.1"
+        assert versions == ["7.0.1"] * 3
+        assert len(test_executor.client.transport.connection_pool.connections) == 1
+
+    def test_stream_query(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path != "/_opendistro/_sql/?format=csv":
+                    body = b'{"error": {"reason": "bad format"}, "status": 400}'
+                    self.send_response(400)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in (b"a,b\n", b"1,2\n", b"3,4"):
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *_):
+                pass
+
+        # pooled connections are kept alive, each of them needs a thread of its own
+        server = ThreadingHTTPServer(("localhost", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        test_executor = ESConnection(endpoint="http://localhost:%d" % server.server_address[1])
+        test_executor.client = test_executor.build_client()
+        stream = io.BytesIO()
+        profile = QueryProfile()
+
+        assert test_executor.stream_query("select a, b from t;", "csv", stream, use_console=False, profile=profile)
+        assert stream.getvalue() == b"a,b\n1,2\n3,4\n"
+        assert profile.rows == 2
+        assert profile.bytes == 11
+
+        with mock.patch("escli.esconnection.click.secho") as mock_secho:
+            assert not test_executor.stream_query("select a, b from t", "raw", io.BytesIO(), use_console=False)
+        server.shutdown()
+
+        mock_secho.assert_called_with(message=mock.ANY, fg="red")
+        assert "bad format" in mock_secho.call_args[1]["message"]
+
+    def test_transport_settings(self):
+        settings = {"http_compress": True, "timeout": 30.0, "maxsize": 16, "max_retries": 5}
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT, http_auth=AUTH, transport_settings=settings)
+
+        client = test_executor.get_open_distro_client()
+        connection = client.transport.connection_pool.connections[0]
+
+        assert client.transport.max_retries == 5
+        assert connection.http_compress
+        assert connection.timeout == 30.0
+        assert connection.pool.pool.maxsize == 16
+
     def test_get_aes_client(self):
         aes_test_executor = ESConnection(endpoint=AES_ENDPOINT)
 
@@ -144,3 +441,160 @@ class TestExecutor:
                 verify_certs=True,
                 connection_class=RequestsHttpConnection,
             )
+
+    def test_execute_query_pages(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        pages = [
+            {
+                "schema": [{"name": "a", "type": "text"}],
+                "total": 3,
+                "size": 2,
+                "datarows": [["x"], ["y"]],
+                "cursor": "c1",
+            },
+            {"datarows": [["z"]]},
+        ]
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.perform_request.side_effect = pages
+            result = list(test_executor.execute_query_pages("select * from t;", fetch_size=2))
+
+        assert result == pages
+        mock_client.transport.perform_request.assert_any_call(
+            url="/_opendistro/_sql/",
+            method="POST",
+            params={"format": "jdbc"},
+            body={"query": "select * from t", "fetch_size": 2},
+        )
+        mock_client.transport.perform_request.assert_called_with(
+            url="/_opendistro/_sql/", method="POST", params={"format": "jdbc"}, body={"cursor": "c1"}
+        )
+
+    def test_page_sizer(self):
+        page_sizer = PageSizer(target_latency=0.5, max_page_bytes=1000)
+
+        assert page_sizer.fetch_size("select * from t") == DEFAULT_FETCH_SIZE
+        # 1ms and 1 byte per row
+        page_sizer.record("select * from t", 0.1, 100, 100)
+        assert page_sizer.fetch_size("SELECT a FROM t WHERE b = 1") == 500
+        # wide rows are limited by max_page_bytes
+        page_sizer.record("select * from w", 0.001, 1000, 100)
+        assert page_sizer.fetch_size("select * from w") == 100
+        # slower pages of t shrink it
+        page_sizer.record("select * from t", 1.0, 100, 100)
+        assert page_sizer.fetch_size("select * from t") < 500
+        page_sizer.record("select * from t", 0.0, 0, 0)
+
+    def test_execute_query_pages_close_cursor(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        first_page = {"schema": [], "total": 3, "size": 1, "datarows": [["x"]], "cursor": "c1"}
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.perform_request.return_value = first_page
+            pages = test_executor.execute_query_pages("select * from t", fetch_size=1)
+            next(pages)
+            pages.close()
+
+        mock_client.transport.perform_request.assert_called_with(
+            url="/_opendistro/_sql/close", method="POST", body={"cursor": "c1"}
+        )
+
+    def test_execute_query_pages_lost_connection(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT, retry_policy=RetryPolicy(retries=0))
+        first_page = {"schema": [], "total": 2, "size": 1, "datarows": [["x"]], "cursor": "c1"}
+
+        with mock.patch.object(test_executor, "client") as mock_client, mock.patch(
+            "escli.esconnection.click.secho"
+        ) as mock_secho:
+            mock_client.transport.perform_request.side_effect = [first_page, ConnectionError("N/A", "lost", None)]
+            pages = test_executor.execute_query_pages("select * from t", fetch_size=1, use_console=False)
+
+            assert next(pages) == first_page
+            with pytest.raises(QueryFailed):
+                next(pages)
+
+        mock_secho.assert_any_call(
+            message="Connection Failed. Check your ES is running and then come back", fg="red", err=True
+        )
+
+    def test_execute_query_result_cache(self):
+        result_cache = MemoryResultCache(ttl=60, max_size=1024)
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT, result_cache=result_cache)
+        data = {"schema": [], "total": 1, "size": 1, "datarows": [["x"]]}
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.transport.perform_request.return_value = data
+            assert test_executor.execute_query("select * from t;") == data
+            assert test_executor.execute_query("select *  from t") == data
+            assert mock_client.transport.perform_request.call_count == 1
+
+            test_executor.execute_query("select * from t", use_cache=False)
+            test_executor.execute_query("select * from t", output_format="csv")
+            assert mock_client.transport.perform_request.call_count == 3
+
+            # statements changing data are never served from cache
+            test_executor.execute_query("delete from t where a = 1")
+            test_executor.execute_query("delete from t where a = 1")
+            assert mock_client.transport.perform_request.call_count == 5
+
+    def test_set_connection_from_cache(self, tmpdir):
+        metadata_cache = MetadataCache(ttl=60, cache_dir=str(tmpdir))
+        metadata_cache.set(INVALID_ENDPOINT, "opendistro_sql", "7.0.1", ["accounts"])
+        test_executor = ESConnection(endpoint=INVALID_ENDPOINT, metadata_cache=metadata_cache)
+
+        with mock.patch.object(ESConnection, "is_sql_plugin_installed") as mock_plugin_check:
+            test_executor.set_connection()
+
+        mock_plugin_check.assert_not_called()
+        assert test_executor.is_metadata_cached
+        assert test_executor.es_version == "7.0.1"
+        assert test_executor.indices_list == ["accounts"]
+
+    def test_get_fields(self):
+        test_executor = ESConnection(endpoint=OPEN_DISTRO_ENDPOINT)
+        mapping = {
+            "accounts": {
+                "mappings": {
+                    "properties": {
+                        "name": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+                        "address": {"properties": {"city": {"type": "keyword"}}},
+                    }
+                }
+            }
+        }
+
+        with mock.patch.object(test_executor, "client") as mock_client:
+            mock_client.indices.get_mapping.return_value = mapping
+            fields = test_executor.get_fields("accounts")
+
+        mock_client.indices.get_mapping.assert_called_with(index="accounts")
+        assert fields == ["address", "address.city", "name", "name.keyword"]
+
+    def test_cancel_query(self):
+        # server which accepts connections but never responds, like a long running query
+        server = socket.socket()
+        server.bind(("localhost", 0))
+        server.listen(1)
+        endpoint = "http://localhost:%d" % server.getsockname()[1]
+
+        test_executor = ESConnection(endpoint=endpoint)
+        test_executor.client = Elasticsearch(
+            [endpoint], connection_class=CancellableHttpConnection, cancel_event=test_executor.cancel_event
+        )
+        errors = []
+
+        def run_query():
+            try:
+                test_executor.execute_query("select * from t", use_console=False)
+            except QueryCancelled as error:
+                errors.append(error)
+
+        query_thread = threading.Thread(target=run_query)
+        query_thread.start()
+        time.sleep(0.5)
+        test_executor.cancel_query()
+        query_thread.join(timeout=5)
+        server.close()
+
+        assert not query_thread.is_alive()
+        assert len(errors) == 1
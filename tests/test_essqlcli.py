@@ -22,6 +22,7 @@ from utils import estest, load_data, TEST_INDEX_NAME, ENDPOINT
 from escli.essqlcli import ESSqlCli
 from escli.esconnection import ESConnection
 from escli.esstyle import style_factory
+from escli.utils import OutputSettings
 
 AUTH = None
 QUERY_WITH_CTRL_D = "select * from %s;\r\x04\r" % TEST_INDEX_NAME
@@ -36,12 +37,133 @@ class TestEssqlcli:
     def test_connect(self, cli):
         with mock.patch.object(ESConnection, "__init__", return_value=None) as mock_ESConnection, mock.patch.object(
             ESConnection, "set_connection"
-        ) as mock_set_connectiuon:
+        ) as mock_set_connectiuon, mock.patch.object(ESConnection, "is_metadata_cached", False, create=True):
             cli.connect(endpoint=ENDPOINT)
 
-            mock_ESConnection.assert_called_with(ENDPOINT, AUTH)
+            mock_ESConnection.assert_called_with(
+                ENDPOINT, AUTH, cli.metadata_cache, cli.result_cache, cli.transport_settings, cli.retry_policy
+            )
             mock_set_connectiuon.assert_called()
 
+    def test_connect_refresh_cached_metadata(self, cli):
+        def set_connection(executor):
+            executor.is_metadata_cached = True
+
+        with mock.patch.object(ESConnection, "set_connection", autospec=True, side_effect=set_connection), mock.patch(
+            "escli.essqlcli.threading.Thread"
+        ) as mock_thread, mock.patch.object(cli.metadata_cache, "invalidate") as mock_invalidate:
+            cli.connect(endpoint=ENDPOINT, refresh=True)
+
+        mock_invalidate.assert_called_with(ENDPOINT)
+        mock_thread.assert_called_with(target=cli.es_executor.refresh_metadata, daemon=True)
+        mock_thread.return_value.start.assert_called()
+
+    def test_special_command(self, cli, capsys):
+        with mock.patch.object(cli, "refresh_metadata") as mock_refresh_metadata:
+            cli.special_commands["\\refresh"] = mock_refresh_metadata
+            cli.execute_special_command("\\refresh;")
+            cli.execute_special_command("\\unknown")
+
+        mock_refresh_metadata.assert_called_with("")
+        assert "Unknown command \\unknown" in capsys.readouterr().out
+
+    def test_timing(self, cli, capsys):
+        cli.execute_special_command("\\timing")
+        with mock.patch.object(cli, "execute_in_background", return_value=None):
+            cli.run_query("select 1")
+
+        assert capsys.readouterr().out.splitlines() == ["Timing is on.", "Time: 0.000s, 0 bytes"]
+
+    def test_nocache_command(self, cli):
+        with mock.patch.object(cli, "execute_in_background", return_value=None) as mock_execute:
+            cli.execute_special_command("\\nocache select 1;")
+
+        mock_execute.assert_called_with("select 1", use_cache=False, profile=mock.ANY)
+
+    def test_searchprofile_command(self, cli):
+        cli.es_executor = mock.Mock()
+        cli.es_executor.profile_search.return_value = {"took": 5, "hits": {"total": 2}}
+
+        with mock.patch.object(cli, "echo_via_pager") as mock_pager:
+            cli.execute_special_command("\\searchprofile select * from t;")
+
+        cli.es_executor.profile_search.assert_called_with("select * from t")
+        mock_pager.assert_called_with(["Took 5ms on 0 shards, 2 hits"])
+
+    def test_record_history(self, cli):
+        cli.history = mock.Mock()
+        with mock.patch.object(cli, "execute_in_background", return_value=None):
+            cli.run_query("select 1")
+
+        cli.history.record.assert_called_with(mock.ANY, None, success=False)
+
+    def test_row_limit_of_limit_query(self, cli):
+        cli.row_limit = 10
+        with mock.patch.object(cli, "execute_in_background", return_value=None) as mock_execute, mock.patch(
+            "escli.essqlcli.click.confirm", return_value=False
+        ) as mock_confirm:
+            cli.run_query("select * from t limit 100")
+            cli.run_query("select * from t limit 5")
+
+        mock_confirm.assert_called_once()
+        mock_execute.assert_any_call("select * from t limit 10", use_cache=True, profile=mock.ANY)
+        mock_execute.assert_called_with("select * from t limit 5", use_cache=True, profile=mock.ANY)
+
+    def test_row_limit_of_pages(self, cli):
+        cli.row_limit = 2
+        cli.result_cache = None
+        cli.output_settings = OutputSettings(table_format="psql")
+        cli.es_executor = mock.Mock()
+        cli.es_executor.page_sizer.fetch_size.return_value = 500
+        first_page = {"schema": [{"name": "a", "type": "long"}], "total": 3, "size": 2, "datarows": [[1], [2]]}
+        pages = mock.MagicMock()
+        pages.__next__.return_value = first_page
+
+        cli.es_executor.execute_query_pages.return_value = pages
+        with mock.patch.object(cli, "echo_via_pager") as mock_pager, mock.patch(
+            "escli.essqlcli.click.confirm", return_value=False
+        ):
+            cli.run_query("select a from t")
+
+        cli.es_executor.execute_query_pages.assert_called_with("select a from t", fetch_size=2, profile=mock.ANY)
+        lines = list(mock_pager.call_args[0][0])
+        assert lines[0] == "fetched rows / total rows = 2/3"
+        assert lines[-2] == "| 2   |"
+        pages.close.assert_called()
+
+    def test_script_command(self, cli, tmpdir, capsys):
+        script = tmpdir.join("script.sql")
+        script.write("select 'a;b' from t;\n-- done;\nselect 2 from t;")
+        cli.output_settings = OutputSettings(table_format="psql")
+        cli.es_executor = mock.Mock()
+        cli.es_executor.execute_query.side_effect = [
+            {"schema": [{"name": "a", "type": "text"}], "datarows": [["a;b"]], "total": 1, "size": 1},
+            None,
+        ]
+
+        cli.execute_special_command("\\i %s" % script)
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == "select 'a;b' from t;"
+        assert "| a;b |" in lines
+        assert "select 2 from t;" in lines
+        assert lines[-1].startswith("Ran 2 statements in ") and lines[-1].endswith(", 1 failed")
+
+        cli.execute_special_command("\\i %s" % tmpdir.join("missing.sql"))
+        assert "Can not read" in capsys.readouterr().out
+
+    def test_slowest_command(self, cli):
+        cli.es_executor = mock.Mock(endpoint=ENDPOINT)
+        cli.history = mock.Mock()
+        cli.history.slowest.return_value = [(1.5, 2, 0.0, ENDPOINT, "select 1")]
+
+        with mock.patch.object(cli, "echo_via_pager") as mock_pager:
+            cli.execute_special_command("\\slowest 5")
+
+        cli.history.slowest.assert_called_with(5, endpoint=ENDPOINT)
+        lines = list(mock_pager.call_args[0][0])
+        assert "duration" in lines[1] and "1.500s" in lines[3] and "select 1" in lines[3]
+
     @estest
     def test_run_cli(self, connection, cli, capsys):
         doc = {"a": "aws"}
@@ -67,6 +189,23 @@ class TestEssqlcli:
             out, err = capsys.readouterr()
             inp.close()
 
-            mock_pager.assert_called_with(expected)
+            assert "\n".join(mock_pager.call_args[0][0]) == expected
             assert out.__contains__("Endpoint: %s" % ENDPOINT)
             assert out.__contains__("See you next search!")
+
+    def test_execute_in_background(self, cli):
+        cli.es_executor = mock.Mock()
+        cli.es_executor.execute_query.return_value = {"datarows": []}
+
+        assert cli.execute_in_background("select 1") == {"datarows": []}
+        cli.es_executor.execute_query.assert_called_with("select 1", use_cache=True, profile=None)
+
+    def test_cancel_in_background(self, cli):
+        cli.es_executor = mock.Mock()
+
+        with mock.patch.object(cli.query_executor, "submit") as mock_submit:
+            mock_submit.return_value.result.side_effect = KeyboardInterrupt()
+            output = cli.execute_in_background("select 1")
+
+        assert output is None
+        cli.es_executor.cancel_query.assert_called()
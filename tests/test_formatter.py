@@ -17,9 +17,10 @@ from __future__ import unicode_literals, print_function
 import mock
 import pytest
 from collections import namedtuple
+from cli_helpers.tabular_output import TabularOutputFormatter
 
 from escli.essqlcli import ESSqlCli, COLOR_CODE_REGEX
-from escli.formatter import Formatter
+from escli.formatter import STREAM_SAMPLE_SIZE, Formatter
 from escli.utils import OutputSettings
 
 
@@ -152,6 +153,140 @@ class TestFormatter:
         ]
         assert list(results) == expected
 
+    def test_format_pages(self):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+        pages = [
+            {
+                "schema": [{"name": "name", "type": "text"}, {"name": "age", "type": "long"}],
+                "total": 2,
+                "datarows": [["Tim", 24]],
+                "size": 1,
+                "cursor": "cursor",
+                "status": 200,
+            },
+            {"datarows": [["Sam", [25, 26]]]},
+        ]
+
+        results = formatter.format_pages(iter(pages))
+
+        expected = [
+            "fetched rows / total rows = 2/2",
+            "+--------+---------+",
+            "| name   | age     |",
+            "|--------+---------|",
+            "| Tim    | 24      |",
+            "| Sam    | [25,26] |",
+            "+--------+---------+",
+        ]
+        assert list(results) == expected
+
+    def test_format_pages_row_limit(self):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+        first_page = {"schema": [{"name": "a", "type": "long"}], "total": 5, "datarows": [[1], [2]], "size": 2}
+
+        def pages():
+            yield first_page
+            yield {"datarows": [[3], [4]]}
+            raise AssertionError("pages after row_limit rows are fetched")
+
+        results = list(formatter.format_pages(pages(), row_limit=3))
+
+        assert results[0] == "fetched rows / total rows = 3/5"
+        assert results[4:7] == ["| 1   |", "| 2   |", "| 3   |"]
+        assert len(results) == 8
+
+    def test_stream_output(self):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+        data = {
+            "schema": [{"name": "name", "type": "text"}, {"name": "age", "type": "long"}],
+            "total": 3,
+            "datarows": iter([["Tim", 24], ["Sam", None], ["Jo", [25, 26]]]),
+            "size": 3,
+            "status": 200,
+        }
+
+        with mock.patch("escli.formatter.STREAM_SAMPLE_SIZE", 1):
+            results = formatter.format_output(data)
+
+        # width of "age" column is measured from the first row only, so the array overflows
+        expected = [
+            "fetched rows / total rows = 3/3",
+            "+--------+-------+",
+            "| name   | age   |",
+            "|--------+-------|",
+            "| Tim    | 24    |",
+            "| Sam    | null  |",
+            "| Jo     | [25,26] |",
+            "+--------+-------+",
+        ]
+        assert list(results) == expected
+
+    def test_format_columns(self):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+        headers = ["name", "age", "score", "tags"]
+        datarows = [["Tim", 24, 1.5, ["a", None]], ["Sam", None, 2.25, True], ["x" * 600, 10**20, None, {"b": 1}]]
+
+        results = formatter.format_columns(datarows, headers)
+
+        expected = TabularOutputFormatter(format_name="psql").format_output(
+            datarows, headers, **formatter.output_kwargs
+        )
+        assert list(results) == list(expected)
+
+    @pytest.mark.parametrize("text", ["multi\nline", "tab\tseparated", "\u4e2d\u6587"])
+    def test_format_columns_fallback(self, text):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+
+        assert formatter.format_columns([["Tim", text]], ["name", "text"]) is None
+
+    def test_large_output_is_streamed(self):
+        settings = OutputSettings(table_format="psql")
+        formatter = Formatter(settings)
+        data = {
+            "schema": [{"name": "a", "type": "long"}],
+            "datarows": [[i] for i in range(STREAM_SAMPLE_SIZE + 1)],
+            "total": STREAM_SAMPLE_SIZE + 1,
+            "size": STREAM_SAMPLE_SIZE + 1,
+        }
+
+        with mock.patch.object(formatter, "format_columns") as mock_format_columns:
+            results = list(formatter.format_output(data))
+
+        mock_format_columns.assert_not_called()
+        assert len(results) == STREAM_SAMPLE_SIZE + 1 + 5
+        assert results[-2] == "| %-4d |" % STREAM_SAMPLE_SIZE
+
+    def test_stream_output_is_lazy(self):
+        settings = OutputSettings(table_format="vertical")
+        formatter = Formatter(settings)
+
+        def datarows():
+            yield ["Tim", 24]
+            yield ["Sam", 25]
+            raise AssertionError("rows should be fetched only when output is consumed")
+
+        data = {
+            "schema": [{"name": "name", "type": "text"}, {"name": "age", "type": "long"}],
+            "total": 3,
+            "datarows": datarows(),
+            "size": 3,
+            "status": 200,
+        }
+
+        with mock.patch("escli.formatter.STREAM_SAMPLE_SIZE", 1):
+            results = formatter.format_output(data)
+            first_lines = [next(results), next(results)]
+
+        assert first_lines == [
+            "fetched rows / total rows = 3/3",
+            "-[ RECORD 1 ]-------------------------\nname | Tim\nage  | 24",
+        ]
+
     @pytest.mark.parametrize("term_height,term_width,text,use_pager", pager_test_data, ids=test_ids)
     def test_pager(self, term_height, term_width, text, use_pager, pset_pager_mocks):
         cli, mock_echo, mock_echo_via_pager, mock_cli = pset_pager_mocks
@@ -166,6 +301,24 @@ class TestFormatter:
             mock_echo_via_pager.assert_not_called()
             mock_echo.assert_called()
 
+    def test_pager_streams_lines(self, pset_pager_mocks):
+        cli, mock_echo, mock_echo_via_pager, mock_cli = pset_pager_mocks
+        mock_cli.output.get_size.return_value = self.termsize(rows=10, columns=10)
+        consumed = []
+
+        def lines():
+            for i in range(100):
+                consumed.append(i)
+                yield str(i)
+
+        cli.echo_via_pager(lines())
+
+        # only the first screenful is read before the pager starts
+        assert len(consumed) == 6
+        paged = mock_echo_via_pager.call_args[0][0]
+        assert list(paged) == ["%d\n" % i for i in range(100)]
+        mock_echo.assert_not_called()
+
     @pytest.mark.parametrize(
         "text,expected_length",
         [
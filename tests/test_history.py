@@ -0,0 +1,91 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.document import Document
+
+from escli.config import get_config
+from escli.history import AutoSuggestFromSqliteHistory, SqliteHistory, get_history
+
+
+@pytest.fixture()
+def history(tmpdir):
+    history = SqliteHistory(str(tmpdir.join("history.db")), endpoint="http://localhost:9200", load_limit=2)
+    yield history
+    history.close()
+
+
+class TestSqliteHistory:
+    def test_bounded_loading(self, history):
+        for query in ["select 1", "select 2", "select 3"]:
+            history.store_string(query)
+
+        assert list(history.load_history_strings()) == ["select 3", "select 2"]
+
+    def test_search(self, history):
+        for query in ["select * from accounts", "select age from logs", "SELECT name FROM accounts WHERE age > 1"]:
+            history.store_string(query)
+
+        assert history.search_prefix("select") == ["select age from logs"]
+        assert history.search_prefix("select * ", limit=5) == ["select * from accounts"]
+        assert history.search("accounts age") == ["SELECT name FROM accounts WHERE age > 1"]
+        # quotes are not taken as FTS syntax
+        assert len(history.search('"accounts')) == 2
+
+    def test_search_without_fts(self, history):
+        history.has_fts = False
+        history.store_string("select * from accounts")
+
+        assert history.search("from accounts") == ["select * from accounts"]
+
+    def test_slowest(self, history):
+        history.store_string("select 1")
+        history.record(0.5, rows=1)
+        history.store_string("select 2")
+        history.record(2.0, rows=2)
+        history.store_string("select x")
+        history.record(9.0, success=False)
+
+        assert [(duration, rows, query) for duration, rows, _, _, query in history.slowest()] == [
+            (2.0, 2, "select 2"),
+            (0.5, 1, "select 1"),
+        ]
+        assert history.slowest(endpoint="http://other:9200") == []
+
+    def test_import_file_history(self, tmpdir, default_config_location):
+        legacy_file = tmpdir.join("history")
+        legacy_file.write("\n# 2019-10-01 10:00:00\n+select 1\n\n# 2019-10-01 10:01:00\n+select a\n+from b\n")
+        config = get_config(default_config_location)
+        config["main"]["history_file"] = str(legacy_file)
+
+        history = get_history(config)
+        assert history.filename == str(legacy_file) + ".db"
+        assert list(history.load_history_strings()) == ["select a\nfrom b", "select 1"]
+        history.close()
+
+        # imported only when the database is created
+        history = get_history(config)
+        assert len(list(history.load_history_strings())) == 2
+        history.close()
+
+    def test_auto_suggest(self, history):
+        history.store_string("select * from accounts\nwhere age > 1")
+        buffer = Buffer(history=history)
+        auto_suggest = AutoSuggestFromSqliteHistory()
+
+        assert auto_suggest.get_suggestion(buffer, Document("select * fr")).text == "om accounts"
+        assert auto_suggest.get_suggestion(buffer, Document("select * from accounts\nwh")).text == "ere age > 1"
+        assert auto_suggest.get_suggestion(buffer, Document("show")) is None
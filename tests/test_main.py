@@ -13,17 +13,34 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import mock
+import os
+import subprocess
+import sys
 from textwrap import dedent
 
 from click.testing import CliRunner
+from elasticsearch.connection_pool import RoundRobinSelector
 
 from utils import estest, load_data, run, get_connection, TEST_INDEX_NAME
-from escli.main import cli
+from escli.main import cli, connect
 from escli.essqlcli import ESSqlCli
+from escli.esconnection import ESConnection, QueryFailed
 
 INVALID_ENDPOINT = "http://invalid:9200"
 ENDPOINT = "http://localhost:9200"
 QUERY = "select * from %s" % TEST_INDEX_NAME
+# dependencies only used in interactive mode, jdbc formatting or by AWS endpoints
+LAZY_MODULES = [
+    "aiohttp",
+    "prompt_toolkit",
+    "pygments",
+    "pyfiglet",
+    "cli_helpers",
+    "tabulate",
+    "boto3",
+    "requests_aws4auth",
+    "pyarrow",
+]
 
 
 class TestMain:
@@ -72,3 +89,175 @@ class TestMain:
             mock_connect.assert_called_with(ENDPOINT, None)
             mock_run_cli.asset_called()
             assert result.exit_code == 0
+
+    def test_batch(self, tmpdir):
+        batch_file = tmpdir.join("queries.sql")
+        batch_file.write("select 1;\nselect 2;")
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query", side_effect=["1", None]
+        ):
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-b", str(batch_file), "-f", "csv", "-c", "1"])
+
+        assert result.output.startswith("select 1;\n1\nTime: ")
+        assert "select 2;\nTime: " in result.output
+        assert result.exit_code == 1
+
+    def test_connect_transport_settings(self, default_config_location):
+        with mock.patch.object(ESConnection, "set_connection"):
+            es_executor = connect(ENDPOINT, None, default_config_location, transport_overrides={"timeout": 5.0})
+            assert "application/json" in es_executor.transport_settings.pop("serializers")
+            assert es_executor.transport_settings == {
+                "http_compress": False,
+                "timeout": 5.0,
+                "selector_class": RoundRobinSelector,
+            }
+
+            es_executor = connect(ENDPOINT, None, default_config_location, concurrency=32)
+            assert es_executor.transport_settings["maxsize"] == 32
+
+    def test_query_failure(self):
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query", return_value=None
+        ):
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select 1"])
+
+        assert result.output == ""
+        assert result.exit_code == 1
+
+    def test_search_profile(self):
+        response = {"took": 5, "hits": {"total": {"value": 0}}, "profile": {"shards": []}}
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "profile_search", return_value=response
+        ) as mock_profile_search:
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select * from t", "--search-profile"])
+
+        mock_profile_search.assert_called_with("select * from t", use_console=False)
+        assert result.output == "Took 5ms on 0 shards, 0 hits\n"
+        assert result.exit_code == 0
+
+    def test_fetch_size_failure(self):
+        def execute_query_pages(*_, **__):
+            yield {"schema": [{"name": "a", "type": "long"}], "total": 2, "size": 1, "datarows": [[1]]}
+            raise QueryFailed("N/A", "lost")
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query_pages", side_effect=execute_query_pages
+        ):
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select a from t", "-s", "1"])
+
+        assert result.exit_code == 1
+
+    def test_export(self, tmpdir):
+        output_file = tmpdir.join("result.ndjson")
+        pages = [{"schema": [{"name": "a", "type": "long"}], "datarows": [[1], [2]]}, {"datarows": [[3]]}]
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query_pages", return_value=iter(pages)
+        ) as mock_execute_query_pages:
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select a from t", "--export", "ndjson", "-o", str(output_file)])
+
+        mock_execute_query_pages.assert_called_with(
+            "select a from t", fetch_size=1000, use_console=False, profile=mock.ANY
+        )
+        assert output_file.read() == '{"a": 1}\n{"a": 2}\n{"a": 3}\n'
+        assert "Exported 3 rows to %s\n" % output_file in result.output
+        assert result.exit_code == 0
+
+    def test_export_failure(self, tmpdir):
+        output_file = tmpdir.join("result.csv")
+
+        def execute_query_pages(*_, **__):
+            yield {"schema": [{"name": "a", "type": "long"}], "datarows": [[1]]}
+            raise QueryFailed("N/A", "lost")
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query_pages", side_effect=execute_query_pages
+        ):
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select a from t", "--export", "csv", "-o", str(output_file)])
+
+        assert "Exported" not in result.output
+        assert result.exit_code == 1
+
+    def test_export_slices(self, tmpdir):
+        output_file = tmpdir.join("result.csv")
+        pages = [{"schema": [{"name": "a", "type": "long"}], "datarows": []}, {"datarows": [[1]]}]
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query_slices", return_value=iter(pages)
+        ) as mock_execute_query_slices:
+            runner = CliRunner()
+            result = runner.invoke(
+                cli, ["-q", "select a from t", "--export", "csv", "-o", str(output_file), "--slices", "4"]
+            )
+
+        mock_execute_query_slices.assert_called_with("select a from t", 4, 1000, use_console=False, profile=mock.ANY)
+        assert output_file.read() == "a\n1\n"
+        assert result.exit_code == 0
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "execute_query_slices", return_value=None
+        ):
+            result = runner.invoke(cli, ["-q", "select a from t limit 1", "--export", "csv", "--slices", "4"])
+
+        assert result.exit_code == 1
+
+        with mock.patch.object(ESConnection, "set_connection") as mock_set_connection:
+            result = runner.invoke(cli, ["-q", "select a from t", "--slices", "4"])
+
+        mock_set_connection.assert_not_called()
+        assert result.output == "--slices is only used with --export\n"
+        assert result.exit_code == 1
+
+    def test_passthrough(self, tmpdir):
+        def stream_query(query, output_format, stream, use_console, profile):
+            stream.write(b"a,b\n1,2\n")
+            return True
+
+        output_file = tmpdir.join("result.csv")
+
+        with mock.patch.object(ESConnection, "set_connection"), mock.patch.object(
+            ESConnection, "stream_query", side_effect=stream_query
+        ) as mock_stream_query, mock.patch.object(ESConnection, "execute_query") as mock_execute_query:
+            runner = CliRunner()
+            result = runner.invoke(cli, ["-q", "select a, b from t", "-f", "csv", "-o", str(output_file)])
+
+            mock_stream_query.assert_called_with("select a, b from t", "csv", mock.ANY, False, mock.ANY)
+            mock_execute_query.assert_not_called()
+            assert output_file.read() == "a,b\n1,2\n"
+            assert result.exit_code == 0
+
+            result = runner.invoke(cli, ["-q", "select a, b from t", "-f", "raw"])
+
+            assert result.stdout_bytes == b"a,b\n1,2\n"
+            assert result.exit_code == 0
+
+            mock_stream_query.side_effect = None
+            mock_stream_query.return_value = False
+            result = runner.invoke(cli, ["-q", "select a, b from t", "-f", "csv"])
+
+            assert result.exit_code == 1
+
+    def test_import_time(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import escli.main"],
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env,
+        )
+
+        # each line is "import time: self [us] | cumulative | imported package"
+        timings = [line.split("|") for line in result.stderr.splitlines() if line.startswith("import time:")]
+        imported = {name.strip().split(".")[0]: int(cumulative) for _, cumulative, name in timings[1:]}
+
+        assert result.returncode == 0
+        message = "escli.main took %dus to import" % imported["escli"]
+        assert [name for name in LAZY_MODULES if name in imported] == [], message
@@ -0,0 +1,136 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import logging
+import mock
+import pytest
+
+from escli.config import get_config
+from escli.profiler import JsonFormatter, QueryProfile, init_logging, summarize_search_profile
+
+
+@pytest.fixture()
+def escli_logger():
+    logger = logging.getLogger("escli")
+    handlers = logger.handlers[:]
+    logger.handlers = []
+
+    yield logger
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers = handlers
+
+
+class TestQueryProfile:
+    def test_report(self):
+        profile = QueryProfile("select * from a")
+        profile.add("connect", 0.5)
+        profile.add_requests(0.3, 0.1, 2048)
+        profile.count_rows({"datarows": [[1], [2]]})
+
+        with mock.patch("escli.profiler.time.perf_counter", side_effect=[1.0, 1.25]):
+            with profile.measure("format"):
+                pass
+
+        assert profile.report() == (
+            "Time: 1.050s (connect 0.500s, network 0.200s, decode 0.100s, format 0.250s), 2048 bytes, 2 rows"
+        )
+
+    def test_count_csv_rows(self):
+        profile = QueryProfile()
+        profile.count_rows("a,b\n1,2\n3,4")
+
+        assert profile.rows == 2
+
+    def test_log_json(self, escli_logger, tmpdir, default_config_location):
+        log_file = tmpdir.join("log")
+        config = get_config(default_config_location)
+        config["main"]["log_file"] = str(log_file)
+
+        init_logging(config)
+        profile = QueryProfile("select 1")
+        profile.add("network", 0.25)
+        profile.log()
+
+        entry = json.loads(log_file.read())
+        assert isinstance(escli_logger.handlers[0].formatter, JsonFormatter)
+        assert entry["level"] == "INFO"
+        assert entry["message"] == "query profile"
+        assert entry["query"] == "select 1"
+        assert entry["phases"] == {"network": 0.25}
+
+    def test_logging_disabled(self, escli_logger, tmpdir, default_config_location):
+        config = get_config(default_config_location)
+        config["main"]["log_file"] = str(tmpdir.join("log"))
+        config["main"]["log_level"] = "NONE"
+
+        init_logging(config)
+        QueryProfile("select 1").log()
+
+        assert tmpdir.listdir() == []
+
+
+class TestSummarizeSearchProfile:
+    def test_summary(self):
+        term_query = {"type": "TermQuery", "description": "name:bob", "time_in_nanos": 1000000}
+        response = {
+            "took": 12,
+            "hits": {"total": {"value": 3, "relation": "eq"}},
+            "profile": {
+                "shards": [
+                    {
+                        "id": "[node][accounts][0]",
+                        "searches": [
+                            {
+                                "query": [
+                                    {
+                                        "type": "BooleanQuery",
+                                        "description": "+name:bob +age:[30 TO 40]",
+                                        "time_in_nanos": 4000000,
+                                        "children": [
+                                            term_query,
+                                            {
+                                                "type": "PointRangeQuery",
+                                                "description": "age:[30 TO 40]",
+                                                "time_in_nanos": 2500000,
+                                            },
+                                        ],
+                                    }
+                                ],
+                                "rewrite_time": 100000,
+                                "collector": [{"name": "SimpleTopScoreDocCollector", "time_in_nanos": 200000}],
+                            }
+                        ],
+                        "aggregations": [
+                            {"type": "LongTermsAggregator", "description": "age_terms", "time_in_nanos": 3000000}
+                        ],
+                    }
+                ]
+            },
+        }
+
+        assert summarize_search_profile(response, top=3) == [
+            "Took 12ms on 1 shards, 3 hits",
+            "shard                query    rewrite  collect  aggregations",
+            "[node][accounts][0]  4.000ms  0.100ms  0.200ms  3.000ms",
+            "Slowest 3 components, by time excluding their children:",
+            "self time  kind         type                 description     shard",
+            "3.000ms    aggregation  LongTermsAggregator  age_terms       [node][accounts][0]",
+            "2.500ms    query        PointRangeQuery      age:[30 TO 40]  [node][accounts][0]",
+            "1.000ms    query        TermQuery            name:bob        [node][accounts][0]",
+        ]
+
+    def test_no_profile(self):
+        assert summarize_search_profile({"took": 1, "hits": {"total": 0}}) == ["Took 1ms on 0 shards, 0 hits"]
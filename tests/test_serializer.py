@@ -0,0 +1,76 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import math
+import mock
+import pytest
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+from escli.serializer import FastJSONSerializer, LazyPage, get_serializer
+
+PAGE = '{"schema": [{"name": "a", "type": "long"}], "datarows": [[1], [2], [3]], "cursor": "abc", "size": 3}'
+
+
+class TestGetSerializer:
+    def test_json(self):
+        assert type(get_serializer("json")) is JSONSerializer
+
+    def test_auto_without_orjson(self):
+        with mock.patch.dict("sys.modules", {"orjson": None}):
+            assert type(get_serializer("auto")) is JSONSerializer
+            with pytest.raises(ImportError):
+                get_serializer("orjson")
+
+    def test_orjson(self):
+        pytest.importorskip("orjson")
+        serializer = get_serializer("auto")
+
+        assert isinstance(serializer, FastJSONSerializer)
+        assert serializer.loads(PAGE)["datarows"] == [[1], [2], [3]]
+        # max of unsigned_long
+        assert serializer.loads('{"a": 18446744073709551615}') == {"a": 2**64 - 1}
+        # rejected by orjson, decoded by json module
+        assert math.isnan(serializer.loads('{"a": NaN}')["a"])
+
+
+class TestLazyPage:
+    def test_iterate_rows(self):
+        page = LazyPage(PAGE)
+
+        assert page["schema"] == [{"name": "a", "type": "long"}]
+        assert page.decoded_rows == 0
+        assert next(page["datarows"]) == [1]
+        assert page.decoded_rows == 1
+        assert list(page["datarows"]) == [[2], [3]]
+        assert page["cursor"] == "abc"
+        assert page.text is None
+
+    def test_read_keys_after_rows(self):
+        page = LazyPage(PAGE)
+        rows = page["datarows"]
+
+        assert next(rows) == [1]
+        # rows left are decoded ahead, and still iterated in order
+        assert page.get("cursor") == "abc"
+        assert "size" in page
+        assert "total" not in page
+        assert page.get("total", 0) == 0
+        assert list(rows) == [[2], [3]]
+        assert page.decoded_rows == 3
+
+    def test_decode_error(self):
+        with pytest.raises(SerializationError):
+            LazyPage('["not", "an", "object"]')
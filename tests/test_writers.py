@@ -0,0 +1,80 @@
+"""
+Copyright 2019, Amazon Web Services Inc.
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import pytest
+
+from escli.writers import CsvWriter, NdjsonWriter, write_pages
+
+SCHEMA = [
+    {"name": "name", "type": "text"},
+    {"name": "age", "type": "long"},
+    {"name": "active", "type": "boolean"},
+    {"name": "tags", "type": "keyword"},
+]
+PAGES = [
+    {"schema": SCHEMA, "total": 3, "size": 2, "datarows": [["Tim", 24, True, ["a", "b"]], ["Sam", None, False, None]]},
+    {"datarows": [["Jo, Jr.", 25, None, "c"]]},
+]
+
+
+class TestWriters:
+    def test_ndjson(self):
+        stream = io.StringIO()
+        writer = NdjsonWriter(stream, SCHEMA)
+        writer.write_rows(PAGES[0]["datarows"])
+        writer.write_rows([])
+
+        assert stream.getvalue() == (
+            '{"name": "Tim", "age": 24, "active": true, "tags": ["a", "b"]}\n'
+            '{"name": "Sam", "age": null, "active": false, "tags": null}\n'
+        )
+
+    def test_csv(self):
+        stream = io.StringIO()
+        writer = CsvWriter(stream, SCHEMA)
+        writer.write_rows(PAGES[0]["datarows"])
+        writer.write_rows(PAGES[1]["datarows"])
+
+        assert stream.getvalue() == (
+            "name,age,active,tags\n" 'Tim,24,true,"[""a"", ""b""]"\n' "Sam,,false,\n" '"Jo, Jr.",25,,c\n'
+        )
+
+    def test_write_pages(self):
+        stream = io.StringIO()
+
+        assert write_pages(iter(PAGES), "csv", stream) == 3
+        assert write_pages(iter([]), "csv", stream) == 0
+
+    @pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+    def test_arrow(self, export_format):
+        pyarrow = pytest.importorskip("pyarrow")
+        import pyarrow.parquet
+
+        stream = io.BytesIO()
+        assert write_pages(iter(PAGES), export_format, stream) == 3
+
+        stream.seek(0)
+        if export_format == "arrow":
+            table = pyarrow.ipc.open_stream(stream).read_all()
+        else:
+            table = pyarrow.parquet.read_table(stream)
+
+        assert table.schema.types == [pyarrow.string(), pyarrow.int64(), pyarrow.bool_(), pyarrow.string()]
+        assert table.to_pydict() == {
+            "name": ["Tim", "Sam", "Jo, Jr."],
+            "age": [24, None, 25],
+            "active": [True, False, None],
+            "tags": ['["a", "b"]', None, "c"],
+        }